@@ -0,0 +1,251 @@
+"""
+Benchmarks of the scheduling and due payment hot paths, over synthetic wallets with varying numbers of scheduled payments.
+The results are written as JSON, so that they can be compared between runs to catch regressions.
+
+The scheduling core can be benchmarked standalone from within this directory:
+
+    python benchmark.py --sizes 100,10000 --output results.json
+
+The plugin benchmarks need Electron Cash to be importable, and are skipped otherwise.  To include them, run this as part
+of the package from the Electron Cash environment:
+
+    python -m scheduled_payments.benchmark
+"""
+
+import argparse
+import json
+import platform
+import random
+import statistics
+import time
+
+# Work around stupid Python packaging import limitations for standalone testing.
+try:
+    from . import scheduler
+    from . import when as when_module
+    from .data_store import DataStore
+    from .payment import Payment
+except:
+    import scheduler
+    import when as when_module
+    from data_store import DataStore
+    from payment import Payment
+
+try:
+    from .qt import Plugin
+    PLUGIN_IMPORT_ERROR = None
+except ImportError as e:
+    Plugin = None
+    PLUGIN_IMPORT_ERROR = str(e)
+
+
+# 3rd May 2018.  All benchmarks run against a fake clock starting here, so that they are repeatable.
+BENCHMARK_START_TIME = 1525335600
+BENCHMARK_WALLET_NAME = "benchmark"
+DEFAULT_SIZES = [ 100, 10000, 100000 ]
+
+
+class BenchmarkStorage:
+    """ A wallet storage that keeps the data in memory, but serialises what is put into it as the wallet storage does. """
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key, default=None):
+        value = self.data.get(key, None)
+        if value is None:
+            return default
+        return json.loads(value)
+
+    def put(self, key, value):
+        self.data[key] = json.dumps(value)
+
+    def write(self):
+        pass
+
+
+class BenchmarkConfig:
+    def fee_per_kb(self):
+        return 1000
+
+
+class BenchmarkWallet:
+    def __init__(self, storage):
+        self.storage = storage
+        self.contacts = {}
+
+    def basename(self):
+        return BENCHMARK_WALLET_NAME
+
+    def has_password(self):
+        # Payments are marked as overdue rather than paid automatically.
+        return True
+
+
+class BenchmarkWindow:
+    """ Just enough of a wallet window for the plugin to process the due payments of its wallet. """
+
+    def __init__(self, wallet):
+        self.wallet = wallet
+        self.config = BenchmarkConfig()
+        self.network = None
+
+    def notify(self, message):
+        pass
+
+
+def create_when_texts(size, rng):
+    when_texts = []
+    for i in range(size):
+        when = when_module.When()
+        if rng.random() < 0.5:
+            when.setWeekDay(rng.randint(1, 7))
+        else:
+            when.setMonthDay(rng.randint(1, 31))
+        when.setTime(rng.randint(0, 23), rng.randrange(0, 60, 5))
+        when_texts.append(when.toText())
+    return when_texts
+
+def create_payments(size, rng, current_time):
+    """ Scheduled payments with random schedules, all up to date as of the given time. """
+    payments = []
+    for i, when_text in enumerate(create_when_texts(size, rng)):
+        payment_data = Payment()
+        payment_data.id = "%032x" % rng.getrandbits(128)
+        payment_data.address = "bitcoincash:benchmark%08d" % i
+        payment_data.amount = rng.randint(1000, 100000000)
+        payment_data.description = "Benchmark payment %d" % i
+        payment_data.when = when_module.When.fromText(when_text)
+        payment_data.count0 = payment_data.countn = 100001
+        payment_data.date_created = payment_data.date_updated = int(current_time)
+        payment_data.date_next_paid = scheduler.WhenEstimator(current_time, payment_data.when).getNextOccurrences(1)[0]
+        payments.append(payment_data)
+    return payments
+
+def create_wallet_storage(payments):
+    """ A wallet storage holding the given payments, as they would be after being saved. """
+    storage = BenchmarkStorage()
+    wallet_data = DataStore(storage)
+    for payment_data in payments:
+        wallet_data.payments[payment_data.id] = payment_data
+    wallet_data.save()
+    return storage
+
+def create_plugin(storage, clock):
+    """ A plugin with the wallet for the given storage loaded, but without any of its UI. """
+    plugin = Plugin(None, None, "scheduled_payments")
+    plugin.clock = clock
+    window = BenchmarkWindow(BenchmarkWallet(storage))
+    plugin.wallet_windows[BENCHMARK_WALLET_NAME] = window
+    plugin.load_data_for_wallet(BENCHMARK_WALLET_NAME, window)
+    return plugin
+
+
+def measure(function, repeat, setup=None):
+    """ Time the function the given number of times, each with a fresh argument from the setup function if given. """
+    timings = []
+    for i in range(repeat):
+        argument = setup() if setup is not None else None
+        start_time = time.perf_counter()
+        if setup is not None:
+            function(argument)
+        else:
+            function()
+        timings.append(time.perf_counter() - start_time)
+    return timings
+
+def make_result(name, size, item_count, timings):
+    best_time = min(timings)
+    return {
+        "name": name,
+        "size": size,
+        "items": item_count,
+        "repeat": len(timings),
+        "best_seconds": best_time,
+        "mean_seconds": statistics.mean(timings),
+        "best_microseconds_per_item": best_time * 1000000 / item_count if item_count else None,
+    }
+
+def run_benchmarks(sizes, repeat, seed):
+    results = []
+    skipped = []
+    for size in sizes:
+        rng = random.Random(seed)
+        payments = create_payments(size, rng, BENCHMARK_START_TIME)
+        when_texts = [ payment_data.when.toText() for payment_data in payments ]
+
+        def parse_when_texts_cold():
+            when_module.compiledWhens.clear()
+            for when_text in when_texts:
+                when_module.When.fromText(when_text)
+        results.append(make_result("When.fromText cold", size, size, measure(parse_when_texts_cold, repeat)))
+
+        def parse_when_texts_warm():
+            for when_text in when_texts:
+                when_module.When.fromText(when_text)
+        results.append(make_result("When.fromText warm", size, size, measure(parse_when_texts_warm, repeat)))
+
+        def get_next_occurrences():
+            for payment_data in payments:
+                scheduler.WhenEstimator(BENCHMARK_START_TIME, payment_data.when).getNextOccurrences(10)
+        results.append(make_result("WhenEstimator.getNextOccurrences", size, size, measure(get_next_occurrences, repeat)))
+
+        storage = create_wallet_storage(payments)
+
+        results.append(make_result("DataStore.save", size, size, measure(DataStore.save, repeat, setup=lambda: DataStore(storage))))
+
+        if Plugin is None:
+            skipped.append({ "size": size, "names": [ "Plugin.get_due_payments_for_wallet", "Plugin.dispatch_due_payment" ], "reason": PLUGIN_IMPORT_ERROR })
+            continue
+
+        # A week on, every weekly payment and around a quarter of the monthly payments are due.
+        due_time = BENCHMARK_START_TIME + 7 * 24 * 60 * 60
+        plugin = create_plugin(storage, scheduler.FakeClock(due_time))
+        due_count = len(plugin.get_due_payments_for_wallet(BENCHMARK_WALLET_NAME, due_time))
+
+        def get_due_payments():
+            plugin.get_due_payments_for_wallet(BENCHMARK_WALLET_NAME, due_time)
+        results.append(make_result("Plugin.get_due_payments_for_wallet", size, due_count, measure(get_due_payments, repeat)))
+
+        def create_due_payments():
+            plugin = create_plugin(storage, scheduler.FakeClock(due_time))
+            return plugin, plugin.get_due_payments_for_wallet(BENCHMARK_WALLET_NAME, due_time)
+        def dispatch_due_payments(args):
+            plugin, due_payment_entries = args
+            for payment_data in due_payment_entries:
+                plugin.dispatch_due_payment(BENCHMARK_WALLET_NAME, payment_data, due_time)
+        results.append(make_result("Plugin.dispatch_due_payment", size, due_count, measure(dispatch_due_payments, repeat, setup=create_due_payments)))
+
+    return results, skipped
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Benchmark the scheduled payment hot paths.")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES), help="comma separated numbers of scheduled payments per wallet")
+    parser.add_argument("--repeat", type=int, default=3, help="how many times to time each benchmark")
+    parser.add_argument("--seed", type=int, default=1, help="seed for the synthetic wallets")
+    parser.add_argument("--output", default=None, help="file to write the JSON results to, rather than standard output")
+    args = parser.parse_args(args)
+
+    sizes = [ int(size) for size in args.sizes.split(",") ]
+    results, skipped = run_benchmarks(sizes, args.repeat, args.seed)
+    report = {
+        "python": platform.python_version(),
+        "numpy": None if scheduler.numpy is None else scheduler.numpy.__version__,
+        "timezone": time.tzname,
+        "start_time": BENCHMARK_START_TIME,
+        "seed": args.seed,
+        "results": results,
+        "skipped": skipped,
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, "w") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
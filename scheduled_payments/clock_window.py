@@ -8,6 +8,8 @@ from PyQt5.QtWidgets import *
 from electroncash.i18n import _
 from electroncash_gui.qt.util import MessageBoxMixin
 
+from .instrumentation import stats
+
 
 SPEED_FAKE_SECOND_PER_REAL_SECOND = 0
 SPEED_FAKE_MINUTE_PER_REAL_SECOND = 1
@@ -41,6 +43,8 @@ class ClockWindow(QDockWidget, MessageBoxMixin):
         vbox.addWidget(self.clockWidget)
         self.settingsWidget = SettingsWidget(self, _("Settings"), self.plugin.clock)
         vbox.addWidget(self.settingsWidget)
+        self.statsWidget = StatsWidget(self, _("Statistics"))
+        vbox.addWidget(self.statsWidget)
         widget.setLayout(vbox)
         
         self.setWidget(widget)
@@ -70,6 +74,7 @@ class ClockWindow(QDockWidget, MessageBoxMixin):
             clock.setTime(clock.getTime() + (threadCurrentTime - self.lastThreadTime) * self.speedMultiplier)
             self.lastThreadTime = threadCurrentTime
         self.clockWidget.updateTime(clock)
+        self.statsWidget.updateStats()
         
         
 class ClockWidget(QGroupBox):
@@ -241,3 +246,65 @@ class SettingsWidget(QGroupBox):
         self.runButton.setEnabled(runButtonEnabled)
         self.pauseButton.setEnabled(enabled and self.fakeClockState == FAKE_CLOCK_RUNNING)
 
+
+class StatsWidget(QGroupBox):
+    """ The counters and timings of the plugin's hot paths. """
+
+    def __init__(self, window, text):
+        self.window = window
+
+        QGroupBox.__init__(self, text)
+
+        vbox = QVBoxLayout()
+        self.setLayout(vbox)
+
+        self.timingsTree = QTreeWidget()
+        self.timingsTree.setHeaderLabels([ _("Name"), _("Count"), _("Last ms"), _("Mean ms"), _("p95 ms") ])
+        self.timingsTree.setRootIsDecorated(False)
+        self.timingsTree.setUniformRowHeights(True)
+        vbox.addWidget(self.timingsTree)
+
+        self.countersLabel = QLabel()
+        self.countersLabel.setWordWrap(True)
+        vbox.addWidget(self.countersLabel)
+
+        hbox = QHBoxLayout()
+        hbox.addStretch(1)
+        self.resetButton = QPushButton(_("Reset"))
+        self.resetButton.clicked.connect(self.onResetButtonClicked)
+        hbox.addWidget(self.resetButton)
+        self.dumpButton = QPushButton(_("Save as JSON..."))
+        self.dumpButton.clicked.connect(self.onDumpButtonClicked)
+        hbox.addWidget(self.dumpButton)
+        vbox.addLayout(hbox)
+
+        self.updateStats()
+
+    def formatMilliseconds(self, value):
+        return "-" if value is None else "%.2f" % value
+
+    def updateStats(self):
+        snapshot = stats.get_snapshot()
+
+        self.timingsTree.clear()
+        for name, timing in sorted(snapshot["timings"].items()):
+            item = QTreeWidgetItem([ name, str(timing["count"]), self.formatMilliseconds(timing["last_ms"]),
+                self.formatMilliseconds(timing["mean_ms"]), self.formatMilliseconds(timing["p95_ms"]) ])
+            for column in range(1, 5):
+                item.setTextAlignment(column, Qt.AlignRight | Qt.AlignVCenter)
+            self.timingsTree.addTopLevelItem(item)
+
+        counters = sorted(snapshot["counters"].items())
+        self.countersLabel.setText(", ".join("%s: %d" % (name, value) for name, value in counters) or _("No counters yet."))
+
+    def onResetButtonClicked(self):
+        stats.reset()
+        self.updateStats()
+
+    def onDumpButtonClicked(self):
+        filePath, _filter = QFileDialog.getSaveFileName(self, _("Save Statistics"), "scheduled_payments_stats.json", "JSON (*.json)")
+        if filePath:
+            try:
+                stats.dump(filePath)
+            except OSError as e:
+                self.window.show_error(str(e))
@@ -2,7 +2,11 @@
 MINIMUM_ELECTRON_CASH_VERSION = 3.2
 
 PAYMENT_DATA_KEY = "payments"
+PAYMENT_DATA_VERSION_KEY = "payments_version"
+# 0: Unversioned positional lists.  1: Encoded Payment objects.  2: Delta encoded overdue dates.  3: Run-length encoded overdue dates.
+PAYMENT_DATA_VERSION = 3
 
+# The positions of the fields in the legacy unversioned list format.
 PAYMENT_ADDRESS = 0
 PAYMENT_AMOUNT = 1
 PAYMENT_DATELASTPAID = 2
@@ -23,3 +27,21 @@ ACTION_FORGET = 2
 
 PAYMENT_FLAG_AUTOPAY = 1 << 0
 
+# How far apart the scheduler thread ticks are, in seconds.
+TICK_INTERVAL = 1.0
+# How far the wall clock can move differently to the monotonic clock, in seconds, before it is taken to have jumped.
+TIME_JUMP_THRESHOLD = 5.0
+
+# How many automatic payments can be made at the same time.  Those of the same wallet are still made one at a time.
+AUTOPAY_WORKER_COUNT = 2
+
+# How many wallets can have their due payments evaluated at the same time.
+DUE_PAYMENTS_WORKER_COUNT = 4
+
+
+# The length of the buckets a cash flow forecast is split into.
+FORECAST_PERIOD_DAY = "day"
+FORECAST_PERIOD_WEEK = "week"
+FORECAST_PERIOD_MONTH = "month"
+# The choice of how many days ahead a cash flow forecast covers.
+FORECAST_HORIZON_DAYS = (30, 90, 365)
@@ -1,3 +1,14 @@
+import contextlib
+
+# Work around stupid Python packaging import limitations for standalone testing.
+try:
+    from .constants import *
+    from .instrumentation import stats
+    from .payment import Payment
+except:
+    from constants import *
+    from instrumentation import stats
+    from payment import Payment
 
 STORAGE_KEY = "schedular-payments"
 
@@ -6,28 +17,85 @@ class DataStore(dict):
     This stores the following data for per-wallet persistence (the storage object comes from the wallet).
     
         "payments": [
-            [
-              Address,      # The address to pay to.
-              Amount,       # Satoshis.
-              DateLastPaid, # The date this was last paid, or None otherwise.
-              When,         # Representation of how this is scheduled
-              Count0,       # How many times this should be paid.  -1 = disabled, 0 = complete, > 100000 = countless
-              CountN,       # How many payments remain of the original count.
-              DateCreated,  # The date this schedular payment entry was created.
-              Description,  # The description used to label the payments.
-            ],
-        ]
+            Payment,        # Encoded in storage as a list of field values, see Payment.
+        ],
+        "payments_version": 3,  # The version of the payment encoding, absent for the legacy list format.
+
+    The payments are decoded when the data store is created, and encoded whenever it is written.  Data from earlier
+    versions is migrated to the current version, and written back, on creation.
+
+    In memory, the payments are held in `payments` rather than the underlying dictionary, keyed by payment id in the order
+    they were added.
     """
 
     def __init__(self, storage):
         self.storage = storage
+        self.dirty = False
+        self.transaction_depth = 0
 
         # Restore all our data into the underlying dictionary.
-        self.update(storage.get(STORAGE_KEY, {}))
+        stored_data = dict(storage.get(STORAGE_KEY, {}))
+        version = stored_data.pop(PAYMENT_DATA_VERSION_KEY, 0)
+        payment_entries = stored_data.pop(PAYMENT_DATA_KEY, [])
+        self.update(stored_data)
+
+        if version == 0:
+            payments = [ Payment.decode_legacy(entry) for entry in payment_entries ]
+        else:
+            payments = [ Payment.decode(entry, version) for entry in payment_entries ]
+        self.dirty = version != PAYMENT_DATA_VERSION and len(payments) > 0
+        self.payments = { payment.id: payment for payment in payments }
+
+        # This is a one-time migration, so it is written back immediately.
+        self.flush()
 
     def save(self):
-        # Get a copy of the underlying dictionary.
-        self.storage.put(STORAGE_KEY, dict(self))
+        """ Mark the data as changed.  It is written immediately, or if within a transaction, when the outermost one ends. """
+        self.dirty = True
+        stats.increment("DataStore.save")
+        if self.transaction_depth == 0:
+            self.flush()
+
+    def flush(self):
+        """ Write the data to the wallet storage, if it has changed since it was last written. """
+        if self.dirty:
+            self.dirty = False
+            with stats.timed("DataStore.flush"):
+                # Get a copy of the underlying dictionary.
+                stored_data = dict(self)
+                stored_data[PAYMENT_DATA_KEY] = [ payment.encode() for payment in self.payments.values() ]
+                stored_data[PAYMENT_DATA_VERSION_KEY] = PAYMENT_DATA_VERSION
+                self.storage.put(STORAGE_KEY, stored_data)
+
+    def get_payment(self, payment_id):
+        return self.payments.get(payment_id, None)
+
+    def set_payment(self, payment):
+        """ Add the payment, or replace the existing payment with the same id in place. """
+        self.payments[payment.id] = payment
+        self.save()
+
+    def remove_payments(self, payment_ids):
+        """ Returns the payments that were removed. """
+        removed_payments = []
+        for payment_id in payment_ids:
+            payment = self.payments.pop(payment_id, None)
+            if payment is not None:
+                removed_payments.append(payment)
+        if len(removed_payments):
+            self.save()
+        return removed_payments
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """ Coalesce all the saves made within this context into one write to the wallet storage. """
+        self.transaction_depth += 1
+        try:
+            yield self
+        finally:
+            self.transaction_depth -= 1
+            if self.transaction_depth == 0:
+                self.flush()
 
     def __setitem__(self, key, value):
         dict.__setitem__(self, key, value)
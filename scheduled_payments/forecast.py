@@ -0,0 +1,172 @@
+"""
+Cash flow forecasts for scheduled payments.  A forecast is how much the payments are due to pay out over a coming period,
+split into daily, weekly or monthly buckets, and broken down by the address each payment is made to.
+"""
+
+import bisect
+import datetime
+
+# Work around stupid Python packaging import limitations for standalone testing.
+try:
+    from . import scheduler
+    from .constants import *
+    from .instrumentation import stats
+    from .util import LRUCache
+except:
+    import scheduler
+    from constants import *
+    from instrumentation import stats
+    from util import LRUCache
+
+
+def get_bucket_start_date(period, value):
+    """ The local date that the bucket the given time falls in starts on. """
+    start_date = datetime.datetime.fromtimestamp(int(value)).date()
+    if period == FORECAST_PERIOD_WEEK:
+        return start_date - datetime.timedelta(days=start_date.weekday())
+    elif period == FORECAST_PERIOD_MONTH:
+        return start_date.replace(day=1)
+    return start_date
+
+def get_next_bucket_start_date(period, start_date):
+    if period == FORECAST_PERIOD_WEEK:
+        return start_date + datetime.timedelta(days=7)
+    elif period == FORECAST_PERIOD_MONTH:
+        year, month = scheduler.nextMonth(start_date.year, start_date.month)
+        return datetime.date(year, month, 1)
+    return start_date + datetime.timedelta(days=1)
+
+def get_bucket_times(period, start_time, end_time):
+    """ The local midnight that each bucket starts at, from the one the start time falls in to the one the end time falls in. """
+    bucket_times = []
+    bucket_date = get_bucket_start_date(period, start_time)
+    while True:
+        bucket_time = scheduler.localTimeSeconds(datetime.datetime.combine(bucket_date, datetime.time()))
+        if bucket_time > end_time:
+            break
+        bucket_times.append(bucket_time)
+        bucket_date = get_next_bucket_start_date(period, bucket_date)
+    return bucket_times
+
+
+class Forecast:
+    """
+    The amounts due to be paid out after the start time, up to and including the end time.  The amounts are in satoshis,
+    and are kept per payee address as a list with an entry for each bucket.  Only the payees that are paid something
+    have an entry.
+    """
+
+    def __init__(self, period, start_time, end_time):
+        self.period = period
+        self.start_time = start_time
+        self.end_time = end_time
+        self.bucket_times = get_bucket_times(period, start_time, end_time)
+        self.payee_amounts = {}
+        self.occurrence_count = 0
+
+    def __repr__(self):
+        return "<Forecast period=%s buckets=%d payees=%d total=%d>" % (self.period, len(self.bucket_times), len(self.payee_amounts), self.get_total())
+
+    def add_occurrences(self, address, amount, occurrence_times):
+        """ The occurrence times are expected to be within the forecast, and in order. """
+        amounts = self.payee_amounts.get(address, None)
+        if amounts is None:
+            amounts = self.payee_amounts[address] = [ 0 ] * len(self.bucket_times)
+        for occurrence_time in occurrence_times:
+            amounts[bisect.bisect_right(self.bucket_times, occurrence_time) - 1] += amount
+            self.occurrence_count += 1
+
+    def merge(self, other):
+        """ Add in another forecast for the same period, start time and end time, like that of another wallet. """
+        for address, other_amounts in other.payee_amounts.items():
+            amounts = self.payee_amounts.get(address, None)
+            if amounts is None:
+                self.payee_amounts[address] = list(other_amounts)
+            else:
+                self.payee_amounts[address] = [ a + b for a, b in zip(amounts, other_amounts) ]
+        self.occurrence_count += other.occurrence_count
+
+    def get_bucket_totals(self):
+        return [ sum(amounts) for amounts in zip(*self.payee_amounts.values()) ] or [ 0 ] * len(self.bucket_times)
+
+    def get_payee_totals(self):
+        return { address: sum(amounts) for address, amounts in self.payee_amounts.items() }
+
+    def get_total(self):
+        return sum(sum(amounts) for amounts in self.payee_amounts.values())
+
+    def to_dict(self):
+        return {
+            "period": self.period,
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "bucket_times": self.bucket_times,
+            "bucket_totals": self.get_bucket_totals(),
+            "payee_amounts": self.payee_amounts,
+            "occurrences": self.occurrence_count,
+            "total": self.get_total(),
+        }
+
+
+class ForecastEngine:
+    """
+    Works out the forecasts for the payments of one wallet.  The occurrence times of each payment are kept along with the
+    span they were worked out for, so that as the clock moves on, or a shorter horizon is asked for, they are filtered
+    rather than worked out again.  Those that are missing are worked out together in one batch.
+
+    The plugin invalidates the payments it creates, updates or deletes.  This discards their kept occurrences, and moves
+    the schedule version on, which the finished forecasts are cached by.  Occurrences fall on whole minutes, so forecasts
+    starting or ending within the same minute are the same, and are cached as one.
+    """
+
+    def __init__(self, max_cache_size=32):
+        self.schedule_version = 0
+        self.payment_occurrences = {}
+        self.forecast_cache = LRUCache(max_size=max_cache_size)
+
+    def invalidate(self, payment_ids=None):
+        """ The given payments have changed, or if they are not known, any of them may have. """
+        self.schedule_version += 1
+        self.forecast_cache.clear()
+        if payment_ids is None:
+            self.payment_occurrences.clear()
+        else:
+            for payment_id in payment_ids:
+                self.payment_occurrences.pop(payment_id, None)
+
+    def get_forecast(self, payments, period, start_time, end_time):
+        start_time = int(start_time) // 60 * 60
+        end_time = int(end_time) // 60 * 60
+        cache_key = self.schedule_version, period, start_time, end_time
+        forecast = self.forecast_cache.get(cache_key)
+        if forecast is not None:
+            stats.increment("forecast_cache_hits")
+            return forecast
+
+        with stats.timed("ForecastEngine.get_forecast"):
+            self.update_payment_occurrences(payments, start_time, end_time)
+            forecast = Forecast(period, start_time, end_time)
+            for payment_data in payments:
+                span_start_time, span_end_time, occurrence_times = self.payment_occurrences[payment_data.id]
+                first_index = bisect.bisect_right(occurrence_times, start_time)
+                last_index = bisect.bisect_right(occurrence_times, end_time)
+                if first_index < last_index:
+                    forecast.add_occurrences(payment_data.address, payment_data.amount, occurrence_times[first_index:last_index])
+        self.forecast_cache.set(cache_key, forecast)
+        return forecast
+
+    def update_payment_occurrences(self, payments, start_time, end_time):
+        """ Work out the occurrences of the payments that are not already known for the whole of the given span. """
+        missing_payments = []
+        for payment_data in payments:
+            span = self.payment_occurrences.get(payment_data.id, None)
+            if span is None or span[0] > start_time or span[1] < end_time:
+                missing_payments.append(payment_data)
+        if not len(missing_payments):
+            return
+
+        stats.increment("forecast_payments_estimated", len(missing_payments))
+        whens = [ payment_data.when for payment_data in missing_payments ]
+        indexes, times = scheduler.getOccurrencesBatch(whens, start_time, end_time)
+        for payment_data, occurrence_times in zip(missing_payments, scheduler.groupOccurrencesBatch(len(whens), indexes, times)):
+            self.payment_occurrences[payment_data.id] = start_time, end_time, occurrence_times
@@ -0,0 +1,112 @@
+import datetime
+
+from PyQt5.QtCore import *
+from PyQt5.QtGui import *
+from PyQt5.QtWidgets import *
+
+from electroncash.i18n import _
+from electroncash_gui.qt.util import MessageBoxMixin, Buttons
+
+from .constants import *
+from .util import *
+
+
+class ForecastDialog(QDialog, MessageBoxMixin):
+    """
+    Shows how much the scheduled payments are due to pay out over the coming days, with a row for each day, week or month,
+    and under each of those the payees that are paid in it.  The forecasts are cached by the plugin, so updating this
+    when the payments change only works out what has changed.
+    """
+
+    def __init__(self, window, plugin, wallet_name):
+        # We want to be a top-level window
+        QDialog.__init__(self, parent=None)
+
+        self.main_window = window
+        self.plugin = plugin
+        self.wallet_name = wallet_name
+        self.formatter = plugin.get_value_formatter(wallet_name)
+
+        self.setMinimumWidth(500)
+        self.setMinimumHeight(400)
+        self.setWindowTitle(_("Cash Flow Forecast"))
+
+        formLayout = QFormLayout()
+        self.setLayout(formLayout)
+
+        self.period_combo = QComboBox()
+        for period, period_text in ((FORECAST_PERIOD_DAY, _("Daily")), (FORECAST_PERIOD_WEEK, _("Weekly")), (FORECAST_PERIOD_MONTH, _("Monthly"))):
+            self.period_combo.addItem(period_text, period)
+        self.period_combo.setCurrentIndex(1)
+        self.period_combo.currentIndexChanged.connect(self.update_forecast)
+
+        self.horizon_combo = QComboBox()
+        for days in FORECAST_HORIZON_DAYS:
+            self.horizon_combo.addItem(_("Next {} days").format(days), days)
+        self.horizon_combo.currentIndexChanged.connect(self.update_forecast)
+
+        self.all_wallets_checkbox = QCheckBox(_("Include the payments of all open wallets"))
+        self.all_wallets_checkbox.toggled.connect(self.update_forecast)
+
+        self.tree = QTreeWidget()
+        self.tree.setHeaderLabels([ _("Period"), _("Amount"), _("Share") ])
+        self.tree.setUniformRowHeights(True)
+        self.tree.header().setSectionResizeMode(0, QHeaderView.Stretch)
+
+        self.summaryLabel = QLabel()
+
+        self.refresh_button = b = QPushButton(_("Refresh"))
+        b.clicked.connect(self.update_forecast)
+        self.close_button = b = QPushButton(_("Close"))
+        b.clicked.connect(self.close)
+        b.setDefault(True)
+
+        formLayout.addRow(_("Wallet") +':', QLabel(wallet_name))
+        formLayout.addRow(_("Grouping") +':', self.period_combo)
+        formLayout.addRow(_("Horizon") +':', self.horizon_combo)
+        formLayout.addRow(self.all_wallets_checkbox)
+        formLayout.addRow(self.tree)
+
+        hbox = QHBoxLayout()
+        hbox.addWidget(self.summaryLabel)
+        hbox.addStretch(1)
+        hbox.addLayout(Buttons(self.refresh_button, self.close_button))
+        formLayout.addRow(hbox)
+
+        self.update_forecast()
+
+    def closeEvent(self, event):
+        self.plugin.on_forecast_window_closed(self.wallet_name)
+        event.accept()
+
+    def includes_all_wallets(self):
+        return self.all_wallets_checkbox.isChecked()
+
+    def update_forecast(self):
+        period = self.period_combo.currentData()
+        days = self.horizon_combo.currentData()
+        wallet_name = None if self.includes_all_wallets() else self.wallet_name
+        forecast = self.plugin.get_forecast(period, days, wallet_name)
+
+        self.tree.clear()
+        bucket_totals = forecast.get_bucket_totals()
+        for i, bucket_time in enumerate(forecast.bucket_times):
+            bucket_item = QTreeWidgetItem([ self.format_bucket_time(period, bucket_time), self.format_amount(bucket_totals[i]), "" ])
+            payee_amounts = [ (amounts[i], address) for address, amounts in forecast.payee_amounts.items() if amounts[i] ]
+            for amount, address in sorted(payee_amounts, reverse=True):
+                share = "%d%%" % round(amount * 100 / bucket_totals[i])
+                bucket_item.addChild(QTreeWidgetItem([ self.formatter.format_value(address, DISPLAY_AS_ADDRESS), self.format_amount(amount), share ]))
+            self.tree.addTopLevelItem(bucket_item)
+
+        self.summaryLabel.setText(_("Total: {} ({} payments to {} payees)").format(self.format_amount(forecast.get_total()), forecast.occurrence_count, len(forecast.payee_amounts)))
+
+    def format_amount(self, value):
+        return self.formatter.format_value(value, DISPLAY_AS_AMOUNT)
+
+    def format_bucket_time(self, period, bucket_time):
+        bucket_date = datetime.datetime.fromtimestamp(bucket_time).date()
+        if period == FORECAST_PERIOD_WEEK:
+            return _("Week of {}").format(bucket_date.strftime("%Y-%m-%d"))
+        elif period == FORECAST_PERIOD_MONTH:
+            return bucket_date.strftime("%B %Y")
+        return bucket_date.strftime("%Y-%m-%d %a")
@@ -0,0 +1,92 @@
+import collections
+import contextlib
+import json
+import threading
+import time
+
+# How many of the most recent durations of each timed operation are kept, to work out percentiles from.
+TIMING_SAMPLE_COUNT = 256
+
+
+class TimingStats:
+    __slots__ = ("count", "last", "total", "samples")
+
+    def __init__(self):
+        self.count = 0
+        self.last = 0.0
+        self.total = 0.0
+        self.samples = collections.deque(maxlen=TIMING_SAMPLE_COUNT)
+
+    def add(self, seconds):
+        self.count += 1
+        self.last = seconds
+        self.total += seconds
+        self.samples.append(seconds)
+
+    def get_percentile(self, fraction):
+        samples = sorted(self.samples)
+        if not len(samples):
+            return None
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "last_ms": self.last * 1000,
+            "mean_ms": self.total * 1000 / self.count if self.count else None,
+            "p95_ms": None if not self.count else self.get_percentile(0.95) * 1000,
+        }
+
+
+class Instrumentation:
+    """
+    Counters and durations for the hot paths of the plugin.  Recording is a lock, a few additions and a bounded append, so
+    that it can be left enabled all the time, and the summaries are only worked out when they are looked at.  Work is done
+    on worker threads as well as the GUI thread, hence the lock.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timings = {}
+        self.counters = {}
+
+    def record_timing(self, name, seconds):
+        with self.lock:
+            timing_stats = self.timings.get(name, None)
+            if timing_stats is None:
+                timing_stats = self.timings[name] = TimingStats()
+            timing_stats.add(seconds)
+
+    def increment(self, name, count=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + count
+
+    @contextlib.contextmanager
+    def timed(self, name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_timing(name, time.perf_counter() - start_time)
+
+    def reset(self):
+        with self.lock:
+            self.timings.clear()
+            self.counters.clear()
+
+    def get_snapshot(self):
+        with self.lock:
+            return {
+                "timings": { name: timing_stats.to_dict() for name, timing_stats in self.timings.items() },
+                "counters": dict(self.counters),
+            }
+
+    def dump(self, file_path):
+        snapshot = self.get_snapshot()
+        snapshot["time"] = time.time()
+        with open(file_path, "w") as f:
+            json.dump(snapshot, f, indent=2, sort_keys=True)
+
+
+# Shared by everything in the plugin, as the wallet data stores have no other way to reach the plugin.
+stats = Instrumentation()
@@ -0,0 +1,265 @@
+import bisect
+import itertools
+import math
+
+# Work around stupid Python packaging import limitations for standalone testing.
+try:
+    from . import scheduler
+    from .when import When
+except:
+    import scheduler
+    from when import When
+
+
+class OverdueBacklog:
+    """
+    The overdue occurrences of a payment, as runs of consecutive occurrences of a when.  A run is the time of its first
+    occurrence, the when and the number of occurrences, so however long a payment has gone unpaid its backlog takes up a
+    few values, and the number of overdue occurrences is known without expanding them.  The individual occurrence times
+    are only generated when they are iterated over.
+
+    The first time of a run is kept as is, and the rest of the run is the occurrences of the when that follow it.  The
+    runs are kept ordered by their first time, and do not overlap.  In the wallet storage these are encoded as a list of
+    `[first time, when text, count]` runs.
+    """
+
+    __slots__ = ("firstTimes", "whens", "counts", "totalCount")
+
+    def __init__(self):
+        self.firstTimes = []
+        self.whens = []
+        self.counts = []
+        self.totalCount = 0
+
+    def __len__(self):
+        return self.totalCount
+
+    def __iter__(self):
+        for i in range(len(self.firstTimes)):
+            yield from self._iterRunTimes(i)
+
+    def __contains__(self, value):
+        return self._locate(value) is not None
+
+    def __getitem__(self, index):
+        """ The occurrence time at the given position in the backlog, worked out without expanding the runs before it. """
+        if index < 0:
+            index += self.totalCount
+        if not (0 <= index < self.totalCount):
+            raise IndexError("backlog index out of range")
+        for i, count in enumerate(self.counts):
+            if index < count:
+                return self._getRunTime(i, index)
+            index -= count
+
+    def iterFrom(self, index):
+        """ The occurrence times from the given position in the backlog on, worked out one after another rather than each looked up. """
+        for i, count in enumerate(self.counts):
+            if index < count:
+                yield from self._iterRunTimes(i, self._getRunTime(i, index))
+                for j in range(i + 1, len(self.firstTimes)):
+                    yield from self._iterRunTimes(j)
+                return
+            index -= count
+
+    def __repr__(self):
+        return "<OverdueBacklog runs=%d count=%d>" % (len(self.firstTimes), self.totalCount)
+
+    def _iterRunTimes(self, i, startTime=None, endTime=None):
+        """ The occurrence times of the run from the start time up to and including the end time, without those before them. """
+        firstTime, when, count = self.firstTimes[i], self.whens[i], self.counts[i]
+        if startTime is None or startTime <= firstTime:
+            if endTime is not None and firstTime > endTime:
+                return
+            yield firstTime
+            afterTime, skipCount = firstTime, 0
+        else:
+            # The occurrences before the start time are counted rather than generated, to work out what is left to stream.
+            afterTime = math.ceil(startTime) - 1
+            skipCount = scheduler.countOccurrences(when, firstTime, afterTime)
+        yield from itertools.islice(scheduler.iterOccurrences(when, afterTime, endTime), max(0, count - 1 - skipCount))
+
+    def _getRunTime(self, i, runIndex):
+        if runIndex == 0:
+            return self.firstTimes[i]
+        return scheduler.getNthOccurrence(self.whens[i], self.firstTimes[i], runIndex - 1)
+
+    def _locate(self, value):
+        """ The index of the run the time is an occurrence in, and its index within that run, or None if it is not present. """
+        i = bisect.bisect_right(self.firstTimes, value) - 1
+        if i < 0:
+            return None
+        if value == self.firstTimes[i]:
+            return i, 0
+        runIndex = scheduler.countOccurrences(self.whens[i], self.firstTimes[i], value)
+        if runIndex < self.counts[i] and self._getRunTime(i, runIndex) == value:
+            return i, runIndex
+
+    def _insertRun(self, i, firstTime, when, count):
+        self.firstTimes.insert(i, firstTime)
+        self.whens.insert(i, when)
+        self.counts.insert(i, count)
+        self.totalCount += count
+
+    def _deleteRun(self, i):
+        self.totalCount -= self.counts[i]
+        del self.firstTimes[i]
+        del self.whens[i]
+        del self.counts[i]
+
+    def addRun(self, firstTime, when, count):
+        """ Add the given number of consecutive occurrences of the when, starting with the given occurrence time. """
+        if count <= 0:
+            return
+        if len(self.firstTimes):
+            lastTime = self._getRunTime(-1, self.counts[-1] - 1)
+            if firstTime <= lastTime:
+                # Overlapping the existing backlog is not expected, so the occurrences are added individually.
+                self.add(firstTime, when)
+                for value in itertools.islice(scheduler.iterOccurrences(when, firstTime), count - 1):
+                    self.add(value, when)
+                return
+            # A run that follows on from the last run is merged into it.
+            if self.whens[-1].isSame(when) and scheduler.getNthOccurrence(when, lastTime, 0) == firstTime:
+                self.counts[-1] += count
+                self.totalCount += count
+                return
+        self._insertRun(len(self.firstTimes), firstTime, when, count)
+
+    def add(self, value, when):
+        """ Returns whether the occurrence time was added, or False if it was already present. """
+        if value in self:
+            return False
+        i = bisect.bisect_right(self.firstTimes, value) - 1
+        if i >= 0 and self.counts[i] > 1:
+            # A time within the span of a run splits it around that time, so that the runs do not overlap.
+            firstTime, runWhen, count = self.firstTimes[i], self.whens[i], self.counts[i]
+            beforeCount = 1 + scheduler.countOccurrences(runWhen, firstTime, value)
+            if beforeCount < count:
+                nextTime = scheduler.getNthOccurrence(runWhen, firstTime, beforeCount - 1)
+                self._deleteRun(i)
+                self._insertRun(i, nextTime, runWhen, count - beforeCount)
+                self._insertRun(i, firstTime, runWhen, beforeCount)
+        self._insertRun(bisect.bisect_right(self.firstTimes, value), value, when, 1)
+        return True
+
+    def discard(self, value):
+        """ Returns whether the occurrence time was removed, or False if it was not present.  This may split a run in two. """
+        location = self._locate(value)
+        if location is None:
+            return False
+        i, runIndex = location
+        firstTime, when, count = self.firstTimes[i], self.whens[i], self.counts[i]
+        self._deleteRun(i)
+        if runIndex + 1 < count:
+            nextTime = scheduler.getNthOccurrence(when, firstTime, runIndex)
+            self._insertRun(i, nextTime, when, count - runIndex - 1)
+        if runIndex > 0:
+            self._insertRun(i, firstTime, when, runIndex)
+        return True
+
+    def range(self, startTime=None, endTime=None):
+        """ The occurrence times from the start time up to and including the end time. """
+        values = []
+        firstIndex = 0 if startTime is None else max(0, bisect.bisect_right(self.firstTimes, startTime) - 1)
+        for i in range(firstIndex, len(self.firstTimes)):
+            if endTime is not None and self.firstTimes[i] > endTime:
+                break
+            values.extend(self._iterRunTimes(i, startTime, endTime))
+        return values
+
+    def copy(self):
+        backlog = self.__class__()
+        backlog.firstTimes = list(self.firstTimes)
+        backlog.whens = list(self.whens)
+        backlog.counts = list(self.counts)
+        backlog.totalCount = self.totalCount
+        return backlog
+
+    def encode(self):
+        return [ [ firstTime, when.toText(), count ] for firstTime, when, count in zip(self.firstTimes, self.whens, self.counts) ]
+
+    @classmethod
+    def decode(class_, values):
+        backlog = class_()
+        for firstTime, whenText, count in values:
+            backlog._insertRun(len(backlog.firstTimes), firstTime, When.fromText(whenText), count)
+        return backlog
+
+    @classmethod
+    def fromTimes(class_, values, when):
+        """ Group individual occurrence times, as stored by earlier versions, into runs of the given when. """
+        backlog = class_()
+        lastTime = None
+        for value in sorted(set(values)):
+            if lastTime is not None and scheduler.getNthOccurrence(when, lastTime, 0) == value:
+                backlog.counts[-1] += 1
+                backlog.totalCount += 1
+            else:
+                backlog._insertRun(len(backlog.firstTimes), value, when, 1)
+            lastTime = value
+        return backlog
+
+
+if __name__ == "__main__":
+    # Unit tests
+    # - Adding a time within the span of a run of another when, splits that run rather than overlapping it.
+    # - Overlapping runs of any whens keep the backlog ordered, with every added time present and discardable.
+    # - A copied backlog is not changed by changes to the original.
+    import random
+
+    def makeWhen(weekDay=None, monthDay=None, hour=10, minute=20):
+        when = When()
+        if weekDay is not None:
+            when.setWeekDay(weekDay)
+        else:
+            when.setMonthDay(monthDay)
+        when.setTime(hour, minute)
+        return when.compile()
+
+    def checkBacklog(backlog, expectedTimes):
+        values = list(backlog)
+        assert values == sorted(expectedTimes), (values, sorted(expectedTimes))
+        assert len(backlog) == len(expectedTimes)
+        for index, value in enumerate(values):
+            assert value in backlog and backlog[index] == value
+            assert next(backlog.iterFrom(index)) == value
+        assert list(backlog.iterFrom(len(values) // 2)) == values[len(values) // 2:]
+        for i in range(1, len(backlog.firstTimes)):
+            assert backlog._getRunTime(i - 1, backlog.counts[i - 1] - 1) < backlog.firstTimes[i]
+
+    startTime = 1525335600
+    weekly = makeWhen(weekDay=4)
+    monthly = makeWhen(monthDay=15, hour=12)
+    backlog = OverdueBacklog()
+    firstWeeklyTime = scheduler.getNthOccurrence(weekly, startTime, 0)
+    backlog.addRun(firstWeeklyTime, weekly, 10)
+    expectedTimes = set(scheduler.iterOccurrences(weekly, startTime, backlog[-1]))
+    middleMonthlyTime = scheduler.getNthOccurrence(monthly, firstWeeklyTime, 0)
+    backlog.addRun(middleMonthlyTime, monthly, 1)
+    expectedTimes.add(middleMonthlyTime)
+    checkBacklog(backlog, expectedTimes)
+    copiedBacklog = backlog.copy()
+    assert backlog.discard(backlog[-1])
+    checkBacklog(copiedBacklog, expectedTimes)
+
+    rng = random.Random(1)
+    for trial in range(400):
+        backlog = OverdueBacklog()
+        expectedTimes = set()
+        for j in range(rng.randint(1, 6)):
+            if rng.random() < 0.5:
+                when = makeWhen(weekDay=rng.randint(1, 7), hour=rng.randint(0, 23), minute=rng.randint(0, 59))
+            else:
+                when = makeWhen(monthDay=rng.randint(1, 31), hour=rng.randint(0, 23), minute=rng.randint(0, 59))
+            firstTime = scheduler.getNthOccurrence(when, startTime + rng.randint(0, 200 * 86400), 0)
+            count = rng.randint(1, 20)
+            backlog.addRun(firstTime, when, count)
+            expectedTimes.add(firstTime)
+            expectedTimes.update(itertools.islice(scheduler.iterOccurrences(when, firstTime), count - 1))
+            checkBacklog(backlog, expectedTimes)
+        for value in rng.sample(sorted(expectedTimes), len(expectedTimes) // 2):
+            assert backlog.discard(value)
+            expectedTimes.discard(value)
+            checkBacklog(backlog, expectedTimes)
+    print("ok")
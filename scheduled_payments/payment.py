@@ -0,0 +1,95 @@
+import itertools
+
+# Work around stupid Python packaging import limitations for standalone testing.
+try:
+    from .constants import *
+    from .overdue import OverdueBacklog
+    from .when import When
+except:
+    from constants import *
+    from overdue import OverdueBacklog
+    from when import When
+
+
+class Payment:
+    """
+    A scheduled payment.
+
+    In the wallet storage a payment is encoded as a list of its field values, in the order of the slots below.  This starts
+    with the same layout as the legacy unversioned list format.  Fields are only ever added to the end, and those missing
+    from entries written by earlier versions take on their default values.  The abstract when is stored as text, but is
+    only parsed when the payment is decoded.
+    """
+
+    __slots__ = (
+        "address",          # The address to pay to.
+        "amount",           # Satoshis.
+        "date_last_paid",   # The date this was last paid, or None otherwise.
+        "when",             # When object representing how this is scheduled.
+        "count0",           # How many times this should be paid.  -1 = disabled, 0 = complete, > 100000 = countless
+        "countn",           # How many payments remain of the original count.
+        "date_created",     # The date this schedular payment entry was created.
+        "description",      # The description used to label the payments.
+        "id",               # Unique identifier, assigned when the payment is first saved.
+        "date_updated",     # The date from which occurrences have not yet been accounted for.
+        "date_next_paid",   # The date of the next occurrence.
+        "dates_overdue",    # OverdueBacklog of the occurrences that were not paid.
+        "flags",            # PAYMENT_FLAG_* bits.
+        "txid_last_paid",   # The id of the transaction this was last automatically paid with, or None otherwise.
+    )
+
+    def __init__(self):
+        self.address = None
+        self.amount = None
+        self.date_last_paid = None
+        self.when = None
+        self.count0 = None
+        self.countn = None
+        self.date_created = None
+        self.description = None
+        self.id = None
+        self.date_updated = None
+        self.date_next_paid = None
+        self.dates_overdue = OverdueBacklog()
+        self.flags = 0
+        self.txid_last_paid = None
+
+    def __repr__(self):
+        return "<Payment id=%s when=%s>" % (self.id, self.when)
+
+    def encode(self):
+        values = [ getattr(self, field_name) for field_name in self.__slots__ ]
+        values[WHEN_FIELD_INDEX] = None if self.when is None else self.when.toText()
+        values[DATES_OVERDUE_FIELD_INDEX] = self.dates_overdue.encode()
+        return values
+
+    @classmethod
+    def decode(class_, values, version=PAYMENT_DATA_VERSION):
+        payment = class_()
+        for field_name, value in zip(class_.__slots__, values):
+            setattr(payment, field_name, value)
+        if payment.when is not None:
+            payment.when = When.fromText(payment.when)
+        # Entries written before these fields existed, or by the list format, may have them unset.
+        if payment.dates_overdue is None:
+            payment.dates_overdue = OverdueBacklog()
+        elif version < 2:
+            payment.dates_overdue = OverdueBacklog.fromTimes(payment.dates_overdue, payment.when)
+        elif version < 3:
+            overdue_times = list(itertools.accumulate(payment.dates_overdue))
+            payment.dates_overdue = OverdueBacklog.fromTimes(overdue_times, payment.when)
+        else:
+            payment.dates_overdue = OverdueBacklog.decode(payment.dates_overdue)
+        if payment.flags is None:
+            payment.flags = 0
+        return payment
+
+    @classmethod
+    def decode_legacy(class_, entry):
+        """ Decode an entry from the unversioned positional list format, which may be missing trailing fields. """
+        entry = list(entry) + [ None ] * (PAYMENT_ENTRY_LENGTH - len(entry))
+        return class_.decode(entry[:PAYMENT_ENTRY_LENGTH], 0)
+
+
+WHEN_FIELD_INDEX = Payment.__slots__.index("when")
+DATES_OVERDUE_FIELD_INDEX = Payment.__slots__.index("dates_overdue")
@@ -1,11 +1,12 @@
-
+import bisect
+import itertools
 
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
 
 from electroncash.i18n import _
-from electroncash_gui.qt.util import MessageBoxMixin, Buttons, MyTreeWidget
+from electroncash_gui.qt.util import MessageBoxMixin, Buttons
 
 from .constants import *
 from .util import *
@@ -47,10 +48,14 @@ class PaymentActionDialog(QDialog, MessageBoxMixin):
         self.buttons = [ self.action_button, self.cancel_button ]
         self.summaryLabel = QLabel("Selected total: 0 BCH (0 occurrences)")
 
-        payment_entries = self.plugin.get_wallet_payments(wallet_name)
-        self.table = PaymentTable(self, plugin, wallet_name, payment_entries)
+        self.table = PaymentTable(self, plugin, wallet_name, payment_ids)
+
+        self.selected_only_checkbox = QCheckBox(_("Only show the selected payments"))
+        self.selected_only_checkbox.setChecked(True)
+        self.selected_only_checkbox.toggled.connect(self.on_selected_only_toggled)
 
         formLayout.addRow(_("Wallet") +':', QLabel(wallet_name))
+        formLayout.addRow(self.selected_only_checkbox)
         formLayout.addRow(self.table)
         
         hbox = QHBoxLayout()
@@ -63,6 +68,10 @@ class PaymentActionDialog(QDialog, MessageBoxMixin):
         self.plugin.on_payment_action_window_closed(self.wallet_name)
         event.accept()
 
+    def refresh(self):
+        """ Called by the plugin when the wallet's payments have changed. """
+        self.table.refresh()
+
     def perform_action(self):
         payment_occurrence_keys = self.table.get_selected_payment_occurrence_keys()
         if self.action == ACTION_FORGET:
@@ -72,80 +81,284 @@ class PaymentActionDialog(QDialog, MessageBoxMixin):
             self.plugin.prompt_pay_overdue_payment_occurrences(self.wallet_name, payment_occurrence_keys)
             self.close()
         
-    def on_items_selected(self, selected_ids):
-        self.action_button.setEnabled(len(selected_ids))
+    def on_selected_only_toggled(self, is_checked):
+        self.table.set_payment_ids(self.payment_ids if is_checked else None)
+
+    def on_items_selected(self, occurrence_count, amount):
+        self.action_button.setEnabled(occurrence_count)
         
-        payment_entries = self.plugin.get_wallet_payments(self.wallet_name)
-
-        f = ValueFormatter(self.main_window)
-        amount = 0.0
-        for payment_data in payment_entries:
-            for overdue_date in payment_data[PAYMENT_DATESOVERDUE]:
-                if (payment_data[PAYMENT_ID], overdue_date) in selected_ids:
-                    amount += payment_data[PAYMENT_AMOUNT]
-        self.summaryLabel.setText("Selected total: %s (%d occurrences)" % (f.format_value(amount, DISPLAY_AS_AMOUNT), len(selected_ids)))
+        f = self.plugin.get_value_formatter(self.wallet_name)
+        self.summaryLabel.setText("Selected total: %s (%d occurrences)" % (f.format_value(amount, DISPLAY_AS_AMOUNT), occurrence_count))
         
 
 
-class PaymentTable(MyTreeWidget):
-    def __init__(self, parent, plugin, wallet_name, payment_entries):
-        self.columns = [ _("Date"), _("Description"), _("Amount"), _("Address") ]
+COLUMN_DATE = 0
+COLUMN_DESCRIPTION = 1
+COLUMN_AMOUNT = 2
+COLUMN_ADDRESS = 3
+
+
+class OverdueOccurrencesModel(QAbstractItemModel):
+    """
+    The overdue occurrences of the payments of a wallet, one per row, ordered by payment and then by date.  Nothing is
+    produced for a row until the view asks for it, when the payment it belongs to is found from the running totals of the
+    overdue counts, and its date is looked up in that payment's overdue backlog.  Optionally only the occurrences of a given
+    set of payments are included.
+
+    The displayed values of the payments and their backlogs are copied when the model is refreshed, so that the rows are a
+    snapshot which the due payment worker cannot change under the view.  The occurrences that automatic payments are being
+    made for are left out of the copies, as those are only in the backlogs until the outcome is known and must not be
+    paid or forgotten by the user as well.  The plugin refreshes the model when the wallet's payments change.
 
-        MyTreeWidget.__init__(self, parent, self.create_menu, self.columns, 0, [])
+    Sorting by anything other than the date only reorders the payments, with each payment's occurrences staying together
+    in date order.  Sorting by date is the one case where the dates of all the rows are worked out up front.
+    """
 
+    def __init__(self, window, plugin, wallet_name, payment_ids=None):
+        QAbstractItemModel.__init__(self)
+
+        self.window = window
         self.plugin = plugin
         self.wallet_name = wallet_name
-        self.payment_entries = payment_entries
+
+        self.headers = [ _("Date"), _("Description"), _("Amount"), _("Address") ]
+        self.formatter = plugin.get_value_formatter(wallet_name)
+        self.sort_column = -1
+        self.sort_order = Qt.AscendingOrder
+        self.set_payment_ids(payment_ids)
+
+    def set_payment_ids(self, payment_ids=None):
+        """ Include only the occurrences of the given payments, or those of all the payments in the wallet if not given. """
+        self.payment_ids = payment_ids
+        self.refresh()
+
+    def refresh(self):
+        """ Copy the overdue occurrences of the payments again. """
+        self.beginResetModel()
+        with self.plugin.get_wallet_lock(self.wallet_name):
+            if self.payment_ids is None:
+                payment_entries = self.plugin.get_wallet_payments(self.wallet_name)
+            else:
+                payment_entries = self.plugin.get_wallet_payments_by_id(self.wallet_name, self.payment_ids)
+            autopay_occurrence_times_by_id = self.plugin.get_autopay_occurrence_times(self.wallet_name)
+            # [ (payment_id, description, amount, address), ... ] with the values in the order of the columns after the date.
+            self.payment_entries = []
+            self.payment_backlogs = []
+            for payment_data in payment_entries:
+                backlog = payment_data.dates_overdue.copy()
+                for occurrence_time in autopay_occurrence_times_by_id.get(payment_data.id, ()):
+                    backlog.discard(occurrence_time)
+                if len(backlog):
+                    self.payment_entries.append((payment_data.id, payment_data.description, payment_data.amount, payment_data.address))
+                    self.payment_backlogs.append(backlog)
+        self.layout_rows()
+        self.endResetModel()
+
+    def layout_rows(self):
+        """ Order the rows by the sort column, and work out the running totals that a row's payment is found from. """
+        descending = self.sort_order == Qt.DescendingOrder
+        self.payment_order = list(range(len(self.payment_entries)))
+        self.sorted_rows = None
+        if self.sort_column == COLUMN_DATE:
+            # [ (overdue_date, payment_index), ... ] for every row.
+            self.sorted_rows = [ (overdue_date, i) for i, backlog in enumerate(self.payment_backlogs) for overdue_date in backlog ]
+            self.sorted_rows.sort(reverse=descending)
+        elif self.sort_column > COLUMN_DATE:
+            self.payment_order.sort(key=lambda i: self.payment_entries[i][self.sort_column], reverse=descending)
+
+        self.row_offsets = []
+        self.row_count = 0
+        for i in self.payment_order:
+            self.row_offsets.append(self.row_count)
+            self.row_count += len(self.payment_backlogs[i])
+        self.row_times = {}
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        if (column, order) == (self.sort_column, self.sort_order):
+            return
+        self.beginResetModel()
+        self.sort_column = column
+        self.sort_order = order
+        self.layout_rows()
+        self.endResetModel()
+
+    def get_row_occurrence(self, row):
+        """ The index of the payment the given row is an occurrence of, and the date of that occurrence. """
+        if self.sorted_rows is not None:
+            overdue_date, i = self.sorted_rows[row]
+            return i, overdue_date
+        k = bisect.bisect_right(self.row_offsets, row) - 1
+        i = self.payment_order[k]
+        overdue_date = self.row_times.get(row, None)
+        if overdue_date is None:
+            overdue_date = self.row_times[row] = self.payment_backlogs[i][row - self.row_offsets[k]]
+        return i, overdue_date
+
+    def iter_row_ranges(self, first_row, last_row):
+        """ The given range of rows split by payment, as (payment index, index in its backlog, row count) for each payment. """
+        k = bisect.bisect_right(self.row_offsets, first_row) - 1
+        row = first_row
+        while row <= last_row:
+            next_offset = self.row_offsets[k+1] if k+1 < len(self.row_offsets) else self.row_count
+            row_count = min(last_row + 1, next_offset) - row
+            yield self.payment_order[k], row - self.row_offsets[k], row_count
+            row += row_count
+            k += 1
+
+    def iter_row_keys(self, first_row, last_row):
+        """ The payment id and date of each of the given range of rows, worked out one after another rather than each looked up. """
+        if self.sorted_rows is not None:
+            for overdue_date, i in self.sorted_rows[first_row:last_row+1]:
+                yield self.payment_entries[i][0], overdue_date
+            return
+        for i, backlog_index, row_count in self.iter_row_ranges(first_row, last_row):
+            payment_id = self.payment_entries[i][0]
+            for overdue_date in itertools.islice(self.payment_backlogs[i].iterFrom(backlog_index), row_count):
+                yield payment_id, overdue_date
+
+    def get_rows_amount(self, first_row, last_row):
+        """ The total amount of the given range of rows, worked out per payment they span rather than per row. """
+        if self.sorted_rows is not None:
+            return sum(self.payment_entries[i][COLUMN_AMOUNT] for overdue_date, i in self.sorted_rows[first_row:last_row+1])
+        return sum(row_count * self.payment_entries[i][COLUMN_AMOUNT] for i, backlog_index, row_count in self.iter_row_ranges(first_row, last_row))
+
+    def index(self, row, column, parent=QModelIndex()):
+        if parent.isValid() or not (0 <= row < self.row_count) or not (0 <= column < len(self.headers)):
+            return QModelIndex()
+        return self.createIndex(row, column)
+
+    def parent(self, index):
+        return QModelIndex()
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self.row_count
+
+    def columnCount(self, parent=QModelIndex()):
+        return len(self.headers)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.headers[section]
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.DisplayRole:
+            i, overdue_date = self.get_row_occurrence(index.row())
+            payment_id, description, amount, address = self.payment_entries[i]
+            f = self.formatter
+            column = index.column()
+            if column == COLUMN_DATE:
+                return f.format_value(overdue_date, DISPLAY_AS_DATETIME)
+            elif column == COLUMN_DESCRIPTION:
+                return description
+            elif column == COLUMN_AMOUNT:
+                return f.format_value(amount, DISPLAY_AS_AMOUNT)
+            elif column == COLUMN_ADDRESS:
+                return f.format_value(address, DISPLAY_AS_ADDRESS)
+        elif role == Qt.TextAlignmentRole:
+            if index.column() == COLUMN_AMOUNT:
+                return Qt.AlignRight | Qt.AlignVCenter # Align amount to the right.
+
+
+class PaymentTable(QTreeView):
+    def __init__(self, parent, plugin, wallet_name, payment_ids):
+        QTreeView.__init__(self, parent)
+
+        self.parent = parent
+        self.plugin = plugin
+        self.wallet_name = wallet_name
+
+        self.occurrences_model = OverdueOccurrencesModel(parent.main_window, plugin, wallet_name, payment_ids)
+        self.setModel(self.occurrences_model)
 
         self.setSelectionMode(QAbstractItemView.ExtendedSelection)
-        self.setSortingEnabled(True)
+        self.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.setRootIsDecorated(False)
+        # All rows are the same height, so only the visible rows ever need to be produced.
+        self.setUniformRowHeights(True)
         self.setMinimumWidth(700)
-        
-        self.itemSelectionChanged.connect(self.onItemSelectionChanged)
-        
-        self.applyInitialSelection = True
-        self.update()
-                
-    def on_update(self):
-        item = self.currentItem()
-        current_id = item.data(0, Qt.UserRole) if item else None
-        current_date = item.data(1, Qt.UserRole) if item else None
-        self.clear()
-        
-        rows = self.plugin.get_wallet_payments(self.wallet_name)
-        # TODO: Sort?
-        
-        f = ValueFormatter(self.parent.main_window)
-
-        for payment_data in rows:
-            for overdue_date in payment_data[PAYMENT_DATESOVERDUE]:
-                values = [
-                    f.format_value(overdue_date, DISPLAY_AS_DATETIME),
-                    payment_data[PAYMENT_DESCRIPTION],
-                    f.format_value(payment_data[PAYMENT_AMOUNT], DISPLAY_AS_AMOUNT),
-                    f.format_value(payment_data[PAYMENT_ADDRESS], DISPLAY_AS_ADDRESS),
-                ]
-                item = QTreeWidgetItem(values)
-                item.setData(0, Qt.UserRole, payment_data[PAYMENT_ID])
-                item.setData(1, Qt.UserRole, overdue_date)
-                item.setData(2, Qt.TextAlignmentRole, Qt.AlignRight | Qt.AlignVCenter) # Align amount to the right.
-                self.addTopLevelItem(item)
-                if current_id == payment_data[PAYMENT_ID] and current_date == overdue_date:
-                    self.setCurrentItem(item)
-                if self.applyInitialSelection and payment_data[PAYMENT_ID] in self.parent.payment_ids:
-                    item.setSelected(True)
-
-        self.applyInitialSelection = False
-                
-    def create_menu(self, position):
-        pass
-        
+        self.header().setStretchLastSection(False)
+        self.header().setSectionResizeMode(0, QHeaderView.Stretch)
+        # Until a column is clicked, the rows stay in the order of the payments, which does not need every date worked out.
+        self.header().setSortIndicator(-1, Qt.AscendingOrder)
+        self.setSortingEnabled(True)
+
+        # The selection totals are kept up to date from the changes to the selection, rather than recalculated.
+        self.selected_count = 0
+        self.selected_amount = 0
+        self.selectionModel().selectionChanged.connect(self.onItemSelectionChanged)
+
+        # Refreshing, filtering or sorting resets the model, which clears the selection without signalling it.  The
+        # occurrences that were selected are selected again afterwards, wherever they now are.
+        self.reset_occurrence_keys = set()
+        self.occurrences_model.modelAboutToBeReset.connect(self.on_model_about_to_be_reset)
+        self.occurrences_model.modelReset.connect(self.on_model_reset)
+        self.select_all_rows()
+
+    def set_payment_ids(self, payment_ids=None):
+        self.occurrences_model.set_payment_ids(payment_ids)
+
+    def refresh(self):
+        self.occurrences_model.refresh()
+
+    def on_model_about_to_be_reset(self):
+        self.reset_occurrence_keys = set(self.get_selected_payment_occurrence_keys())
+
+    def on_model_reset(self):
+        self.selected_count = 0
+        self.selected_amount = 0
+        self.select_rows(self.reset_occurrence_keys)
+        self.reset_occurrence_keys = set()
+        self.parent.on_items_selected(self.selected_count, self.selected_amount)
+
+    def select_all_rows(self):
+        """ The occurrences being acted on, are all those of the payments the dialog was opened for. """
+        row_count = self.occurrences_model.rowCount()
+        if row_count:
+            self.select_row_ranges([ (0, row_count-1) ])
+
+    def select_rows(self, payment_occurrence_keys):
+        """ Select the rows of the given occurrences, finding them by going through the rows in order. """
+        if not len(payment_occurrence_keys):
+            return
+        rows = []
+        for row, payment_occurrence_key in enumerate(self.occurrences_model.iter_row_keys(0, self.occurrences_model.rowCount()-1)):
+            if payment_occurrence_key in payment_occurrence_keys:
+                rows.append(row)
+        self.select_row_ranges(get_row_ranges(rows))
+
+    def select_row_ranges(self, row_ranges):
+        model = self.occurrences_model
+        column_count = model.columnCount()
+        selection = QItemSelection()
+        for first_row, last_row in row_ranges:
+            selection.select(model.index(first_row, 0), model.index(last_row, column_count-1))
+        self.selectionModel().select(selection, QItemSelectionModel.Select | QItemSelectionModel.Rows)
+
     def get_selected_payment_occurrence_keys(self):
-        selected_items = self.selectedItems()
-        selected_ids = [ (item.data(0, Qt.UserRole), item.data(1, Qt.UserRole)) for item in self.selectedItems() ]
+        selected_ids = []
+        for selection_range in self.selectionModel().selection():
+            # Each selected row is only counted for the range that covers its first column.
+            if selection_range.left() == 0:
+                selected_ids.extend(self.occurrences_model.iter_row_keys(selection_range.top(), selection_range.bottom()))
         return selected_ids
+    def get_selection_totals(self, selection):
+        """ The number of occurrences in a selection and their total amount, worked out without looking up their dates. """
+        occurrence_count = 0
+        amount = 0
+        for selection_range in selection:
+            # Each selected row is only counted for the range that covers its first column.
+            if selection_range.left() == 0:
+                occurrence_count += selection_range.height()
+                amount += self.occurrences_model.get_rows_amount(selection_range.top(), selection_range.bottom())
+        return occurrence_count, amount
 
-    def onItemSelectionChanged(self):
-        selection_keys = self.get_selected_payment_occurrence_keys()
-        self.parent.on_items_selected(selection_keys)
-
+    def onItemSelectionChanged(self, selected, deselected):
+        selected_count, selected_amount = self.get_selection_totals(selected)
+        deselected_count, deselected_amount = self.get_selection_totals(deselected)
+        self.selected_count += selected_count - deselected_count
+        self.selected_amount += selected_amount - deselected_amount
+        self.parent.on_items_selected(self.selected_count, self.selected_amount)
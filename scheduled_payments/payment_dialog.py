@@ -13,6 +13,7 @@ from electroncash_gui.qt.paytoedit import PayToEdit
 import electroncash.web as web
 
 from .constants import *
+from .payment import Payment
 
 class PaymentDialog(QDialog, MessageBoxMixin):
     def __init__(self, window, plugin, payment_data):
@@ -46,12 +47,12 @@ class PaymentDialog(QDialog, MessageBoxMixin):
         self.value_amount = None
         self.value_payto_outputs = []
         self.value_run_occurrences = self.count_labels.index("Always")
-        self.set_flags(0 if self.payment_data is None else self.payment_data[PAYMENT_FLAGS])
+        self.set_flags(0 if self.payment_data is None else self.payment_data.flags)
         
         if self.payment_data is not None:
-            self.value_description = self.payment_data[PAYMENT_DESCRIPTION]
-            self.value_amount = self.payment_data[PAYMENT_AMOUNT]
-            self.value_run_occurrences = self.payment_data[PAYMENT_COUNT0]
+            self.value_description = self.payment_data.description
+            self.value_amount = self.payment_data.amount
+            self.value_run_occurrences = self.payment_data.count0
         
         # NOTE: Set up the UI for this dialog.
         self.setMinimumWidth(350)        
@@ -94,7 +95,7 @@ class PaymentDialog(QDialog, MessageBoxMixin):
             else:
                 self.payto_edit.setText(address)                
         if payment_data is not None:
-            set_payment_address(payment_data[PAYMENT_ADDRESS])
+            set_payment_address(payment_data.address)
 
         completer = QCompleter()
         completer.setCaseSensitivity(False)
@@ -106,8 +107,8 @@ class PaymentDialog(QDialog, MessageBoxMixin):
         
         if payment_data is not None:
             text = _("No payments made.")
-            if payment_data[PAYMENT_DATELASTPAID] is not None:
-                text = datetime.datetime.fromtimestamp(payment_data[PAYMENT_DATELASTPAID]).strftime("%c")
+            if payment_data.date_last_paid is not None:
+                text = datetime.datetime.fromtimestamp(payment_data.date_last_paid).strftime("%c")
             textLabel = QLabel(text)
             label = HelpLabel(_('Last Paid'), _('Date last paid.') + '\n\n' + _('The date at which this scheduled payment was last meant to send a transaction to the network, which the user acted on'))
             formLayout.addRow(label, textLabel)
@@ -133,7 +134,7 @@ class PaymentDialog(QDialog, MessageBoxMixin):
         from . import when_widget
         importlib.reload(when_widget)
         self.whenWidget = when_widget.WhenWidget(_("When"))
-        self.whenWidget.setWhen(None if payment_data is None else payment_data[PAYMENT_WHEN])
+        self.whenWidget.setWhen(None if payment_data is None else payment_data.when)
         formLayout.addRow(self.whenWidget)
 
         # NOTE: Hook up value events and provide handlers.
@@ -201,17 +202,17 @@ class PaymentDialog(QDialog, MessageBoxMixin):
     
         data_id = None
         if self.payment_data is not None:
-            data_id = self.payment_data[PAYMENT_ID]
+            data_id = self.payment_data.id
             
-        payment_data = [ None ] * PAYMENT_ENTRY_LENGTH
-        payment_data[PAYMENT_ID] = data_id
-        payment_data[PAYMENT_ADDRESS] = self.value_payto_outputs[0][1].to_storage_string()
-        payment_data[PAYMENT_AMOUNT] = self.value_amount
-        payment_data[PAYMENT_DESCRIPTION] = self.value_description
-        payment_data[PAYMENT_COUNT0] = self.value_run_occurrences
-        payment_data[PAYMENT_WHEN] = self.whenWidget.getWhen().toText()
-        payment_data[PAYMENT_DATENEXTPAID] = self.whenWidget.getEstimatedTime()
-        payment_data[PAYMENT_FLAGS] = self.get_flags()
+        payment_data = Payment()
+        payment_data.id = data_id
+        payment_data.address = self.value_payto_outputs[0][1].to_storage_string()
+        payment_data.amount = self.value_amount
+        payment_data.description = self.value_description
+        payment_data.count0 = self.value_run_occurrences
+        payment_data.when = self.whenWidget.getWhen()
+        payment_data.date_next_paid = self.whenWidget.getEstimatedTime()
+        payment_data.flags = self.get_flags()
         
         wallet_name = self.main_window.wallet.basename()
         self.plugin.update_payment(wallet_name, payment_data)
@@ -223,12 +224,15 @@ class PaymentDialog(QDialog, MessageBoxMixin):
         if self.payment_data is None:
             payment_id = None
         else:
-            payment_id = self.payment_data[PAYMENT_ID]
+            payment_id = self.payment_data.id
         self.plugin.on_payment_editor_closed(wallet_name, payment_id)
         event.accept()
         
     def onTimeChanged(self, clock_current_time):
         self.whenWidget.updateEstimatedTime(currentTime=clock_current_time)
+
+    def is_estimate_expired(self, clock_current_time):
+        return self.whenWidget.isEstimateExpired(clock_current_time)
         
     def get_flags(self):
         flags = 0
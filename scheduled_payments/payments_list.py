@@ -5,89 +5,252 @@ from PyQt5.QtCore import *
 from PyQt5.QtWidgets import *
 
 from electroncash.i18n import _
-from electroncash_gui.qt.util import MyTreeWidget, MessageBoxMixin
+from electroncash_gui.qt.util import MessageBoxMixin
 
 from .constants import *
+from .instrumentation import stats
 from .util import *
 
 
-class ScheduledPaymentsList(MyTreeWidget, MessageBoxMixin):
-    def __init__(self, parent, plugin, wallet_name):
-        MyTreeWidget.__init__(self, parent, self.create_menu, [
+COLUMN_DESCRIPTION = 0
+COLUMN_ADDRESS = 1
+COLUMN_AMOUNT = 2
+COLUMN_DATE_LAST_PAID = 3
+COLUMN_DATE_NEXT_PAID = 4
+
+# The raw value of a cell, which is what the columns are sorted by.
+SORT_ROLE = Qt.UserRole + 1
+
+
+class ScheduledPaymentsModel(QAbstractItemModel):
+    """
+    The payments of a wallet, one per row.  The model only holds the payment ids in row order, along with a signature of
+    the displayed values for each, and cells are formatted when the view asks for them.  When the payments change only the
+    rows for the payments that were added, removed or changed are signalled to the view, rather than it being rebuilt.
+
+    The cells are served from the signatures, which are only updated on the GUI thread, so that painting never waits on
+    the wallet lock that the due payment worker holds while it evaluates the payments.
+    """
+
+    def __init__(self, window, plugin, wallet_name):
+        QAbstractItemModel.__init__(self)
+
+        self.window = window
+        self.plugin = plugin
+        self.wallet_name = wallet_name
+
+        self.headers = [
             _('Description'),
             _('Address'),
             _('Amount'),
             _('Last Payment'),
             _('Next Payment'),
-        ], 0, [])
-        self.setSelectionMode(QAbstractItemView.ExtendedSelection)
-        self.setSortingEnabled(True)
-        
+        ]
+        self.payment_ids = []
+        self.payment_rows = {}
+        self.payment_signatures = {}
+
+        self.bad_icon = QIcon(":icons/status_disconnected.png")
+        self.good_icon = QIcon(":icons/status_connected.png")
+        self.formatter = plugin.get_value_formatter(wallet_name)
+
+    def index(self, row, column, parent=QModelIndex()):
+        if parent.isValid() or not (0 <= row < len(self.payment_ids)) or not (0 <= column < len(self.headers)):
+            return QModelIndex()
+        return self.createIndex(row, column)
+
+    def parent(self, index):
+        return QModelIndex()
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.payment_ids)
+
+    def columnCount(self, parent=QModelIndex()):
+        return len(self.headers)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.headers[section]
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        payment_id = self.payment_ids[index.row()]
+        if role == Qt.UserRole:
+            return payment_id
+
+        description, address, amount, date_last_paid, date_next_paid, overdue_count = self.payment_signatures[payment_id]
+        column = index.column()
+        if role == Qt.DisplayRole:
+            f = self.formatter
+            if column == COLUMN_DESCRIPTION:
+                return description
+            elif column == COLUMN_ADDRESS:
+                return f.format_value(address, DISPLAY_AS_ADDRESS)
+            elif column == COLUMN_AMOUNT:
+                return f.format_value(amount, DISPLAY_AS_AMOUNT)
+            elif column == COLUMN_DATE_LAST_PAID:
+                return f.format_value(date_last_paid, DISPLAY_AS_DATETIME)
+            elif column == COLUMN_DATE_NEXT_PAID:
+                return f.format_value(date_next_paid, DISPLAY_AS_DATETIME)
+        elif role == SORT_ROLE:
+            if column == COLUMN_AMOUNT:
+                return amount
+            elif column == COLUMN_DATE_LAST_PAID:
+                return date_last_paid or 0
+            elif column == COLUMN_DATE_NEXT_PAID:
+                return date_next_paid or 0
+            return self.data(index, Qt.DisplayRole)
+        elif role == Qt.DecorationRole:
+            if column == COLUMN_DESCRIPTION:
+                return self.bad_icon if overdue_count else self.good_icon
+        elif role == Qt.ToolTipRole:
+            if column == COLUMN_DESCRIPTION:
+                if overdue_count == 0:
+                    return _("This scheduled payment is up-to-date.")
+                elif overdue_count == 1:
+                    return _("This scheduled payment has 1 overdue occurrence.")
+                return _("This scheduled payment has %d overdue occurrences.") % overdue_count
+        elif role == Qt.TextAlignmentRole:
+            if column == COLUMN_AMOUNT:
+                return Qt.AlignRight | Qt.AlignVCenter # Align amount to the right.
+
+    def get_payment_signature(self, payment_data):
+        """ The values a row is displayed from, so that whether a payment needs its row redrawn can be told cheaply. """
+        return (payment_data.description, payment_data.address, payment_data.amount, payment_data.date_last_paid,
+            payment_data.date_next_paid, len(payment_data.dates_overdue))
+
+    def update_payments(self, payment_ids=None):
+        """
+        Bring the rows into line with the wallet's payments.  If the ids of the payments that were added, changed or deleted
+        are given, only those are looked at, otherwise all of them are.
+        """
+        with self.plugin.get_wallet_lock(self.wallet_name):
+            if payment_ids is None:
+                wallet_payments = self.plugin.get_wallet_payments(self.wallet_name)
+                payment_ids = set(self.payment_rows)
+                payment_ids.update(payment_data.id for payment_data in wallet_payments)
+            else:
+                wallet_payments = self.plugin.get_wallet_payments_by_id(self.wallet_name, payment_ids)
+
+            payments_by_id = { payment_data.id: payment_data for payment_data in wallet_payments }
+            removed_rows = []
+            added_payments = []
+            changed_rows = []
+            for payment_id in payment_ids:
+                payment_data = payments_by_id.get(payment_id, None)
+                row = self.payment_rows.get(payment_id, None)
+                if payment_data is None:
+                    if row is not None:
+                        removed_rows.append(row)
+                elif row is None:
+                    added_payments.append((payment_data.id, self.get_payment_signature(payment_data)))
+                else:
+                    signature = self.get_payment_signature(payment_data)
+                    if signature != self.payment_signatures[payment_id]:
+                        self.payment_signatures[payment_id] = signature
+                        changed_rows.append(row)
+
+        # Changed rows are signalled before any removals shift the row numbers.
+        for first_row, last_row in get_row_ranges(changed_rows):
+            self.dataChanged.emit(self.index(first_row, 0), self.index(last_row, len(self.headers)-1))
+
+        if len(removed_rows):
+            # Removing from the end first, leaves the row numbers of the remaining ranges to remove unchanged.
+            for first_row, last_row in reversed(get_row_ranges(removed_rows)):
+                self.beginRemoveRows(QModelIndex(), first_row, last_row)
+                for payment_id in self.payment_ids[first_row:last_row+1]:
+                    del self.payment_signatures[payment_id]
+                del self.payment_ids[first_row:last_row+1]
+                self.endRemoveRows()
+            self.payment_rows = { payment_id: row for row, payment_id in enumerate(self.payment_ids) }
+
+        if len(added_payments):
+            first_row = len(self.payment_ids)
+            self.beginInsertRows(QModelIndex(), first_row, first_row + len(added_payments) - 1)
+            for row, (payment_id, signature) in enumerate(added_payments, first_row):
+                self.payment_ids.append(payment_id)
+                self.payment_rows[payment_id] = row
+                self.payment_signatures[payment_id] = signature
+            self.endInsertRows()
+
+
+    def update_addresses(self, addresses):
+        """ Redraw the addresses of the payments to any of the given addresses, as how they are displayed has changed. """
+        addresses = set(addresses)
+        changed_rows = [ row for row, payment_id in enumerate(self.payment_ids) if self.payment_signatures[payment_id][1] in addresses ]
+        for first_row, last_row in get_row_ranges(changed_rows):
+            self.dataChanged.emit(self.index(first_row, COLUMN_ADDRESS), self.index(last_row, COLUMN_ADDRESS))
+
+
+class ScheduledPaymentsList(QTreeView, MessageBoxMixin):
+    def __init__(self, parent, plugin, wallet_name):
+        QTreeView.__init__(self, parent)
+
+        self.parent = parent
         self.plugin = plugin
         self.wallet_name = wallet_name
 
+        self.payments_model = ScheduledPaymentsModel(parent, plugin, wallet_name)
+        self.proxy_model = QSortFilterProxyModel(self)
+        self.proxy_model.setSourceModel(self.payments_model)
+        self.proxy_model.setSortRole(SORT_ROLE)
+        self.proxy_model.setDynamicSortFilter(True)
+        self.proxy_model.setFilterKeyColumn(-1)
+        self.proxy_model.setFilterCaseSensitivity(Qt.CaseInsensitive)
+        self.setModel(self.proxy_model)
+
+        self.setContextMenuPolicy(Qt.CustomContextMenu)
+        self.customContextMenuRequested.connect(self.create_menu)
+        self.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.setRootIsDecorated(False)
+        # All rows are the same height, which lets the view lay out large numbers of them without measuring each one.
+        self.setUniformRowHeights(True)
+        self.setSortingEnabled(True)
+        self.header().setStretchLastSection(False)
+        self.header().setSectionResizeMode(COLUMN_DESCRIPTION, QHeaderView.Stretch)
+
+    def get_selected_payment_ids(self):
+        return [ index.data(Qt.UserRole) for index in self.selectionModel().selectedRows() ]
+
     def create_menu(self, position):
         menu = QMenu()
-        selected_items = self.selectedItems()
-        selected_payment_ids = [ v.data(0, Qt.UserRole) for v in selected_items ]
-        if len(selected_items) == 0: 
+        selected_payment_ids = self.get_selected_payment_ids()
+        if len(selected_payment_ids) == 0:
             menu.addAction(_("New scheduled payment"), lambda: self.plugin.open_create_payment_dialog(self.wallet_name))
             menu.addAction(_("Toggle clock window"), lambda: self.plugin.toggle_clock_window(self.wallet_name))
-        elif len(selected_items) == 1:
-            menu.addAction(_("Edit"), lambda: self.plugin.open_edit_payment_dialog(self.wallet_name, selected_items[0].data(0, Qt.UserRole)))
-        if len(selected_items) >= 1:
+            menu.addAction(_("Cash flow forecast"), lambda: self.plugin.open_forecast_window(self.wallet_name))
+        elif len(selected_payment_ids) == 1:
+            menu.addAction(_("Edit"), lambda: self.plugin.open_edit_payment_dialog(self.wallet_name, selected_payment_ids[0]))
+        if len(selected_payment_ids) >= 1:
             menu.addAction(_("Delete"), lambda: self.on_delete(selected_payment_ids))
-            
-        if len(selected_items) and self.plugin.check_payments_overdue(self.wallet_name, selected_payment_ids):
+
+        if len(selected_payment_ids) and self.plugin.check_payments_overdue(self.wallet_name, selected_payment_ids):
             menu.addAction(_("Pay overdue occurrences"), lambda: self.on_pay_overdue_occurrences(selected_payment_ids))
             menu.addAction(_("Forget overdue occurrences"), lambda: self.on_forget_overdue_occurrences(selected_payment_ids))
-                    
+
         menu.exec_(self.viewport().mapToGlobal(position))
-        
+
     def on_pay_overdue_occurrences(self, payment_ids):
         self.plugin.open_payment_action_window(self.wallet_name, payment_ids, ACTION_PAY)
-        
+
     def on_forget_overdue_occurrences(self, payment_ids):
         self.plugin.open_payment_action_window(self.wallet_name, payment_ids, ACTION_FORGET)
-        
+
     def on_delete(self, selected_ids):
         if self.question(_("Are you sure you want to delete the selected payments?"), title=_("Delete Scheduled Payments")):
             self.plugin.delete_payments(self.wallet_name, selected_ids)
 
-    def on_update(self):
-        item = self.currentItem()
-        current_key = item.data(0, Qt.UserRole) if item else None
-        self.clear()
-        
-        rows = self.plugin.get_wallet_payments(self.wallet_name)
-        # TODO: Sort?
-        
-        badIcon = QIcon(":icons/status_disconnected.png")
-        goodIcon = QIcon(":icons/status_connected.png")
-
-        f = ValueFormatter(self.parent)
-        for row in rows:
-            row_key = row[PAYMENT_ID]
-            values = [
-                row[PAYMENT_DESCRIPTION],
-                f.format_value(row[PAYMENT_ADDRESS], DISPLAY_AS_ADDRESS),
-                f.format_value(row[PAYMENT_AMOUNT], DISPLAY_AS_AMOUNT),
-                f.format_value(row[PAYMENT_DATELASTPAID], DISPLAY_AS_DATETIME),
-                f.format_value(row[PAYMENT_DATENEXTPAID], DISPLAY_AS_DATETIME),
-            ]
-            item = QTreeWidgetItem(values)
-            if len(row[PAYMENT_DATESOVERDUE]):
-                item.setIcon(0, badIcon)
-                if len(row[PAYMENT_DATESOVERDUE]) == 1:
-                    item.setToolTip(0, _("This scheduled payment has 1 overdue occurrence."))
-                else:
-                    item.setToolTip(0, _("This scheduled payment has %d overdue occurrences.") % len(row[PAYMENT_DATESOVERDUE]))
-            else:
-                item.setIcon(0, goodIcon)
-                item.setToolTip(0, _("This scheduled payment is up-to-date."))
-            item.setData(0, Qt.UserRole, row_key)
-            item.setData(2, Qt.TextAlignmentRole, Qt.AlignRight | Qt.AlignVCenter) # Align amount to the right.
-            self.addTopLevelItem(item)
-            if row_key == current_key:
-                self.setCurrentItem(item)
+    def filter(self, p):
+        """ Called by the wallet window search box, when this is the current tab. """
+        self.proxy_model.setFilterFixedString(p)
+
+    def update_payments(self, payment_ids=None):
+        with stats.timed("ScheduledPaymentsList.update_payments"):
+            self.payments_model.update_payments(payment_ids)
 
+    def update_addresses(self, addresses):
+        self.payments_model.update_addresses(addresses)
@@ -1,3 +1,7 @@
+import concurrent.futures
+import itertools
+import threading
+import traceback
 import uuid
 import time
 import weakref
@@ -14,40 +18,84 @@ from electroncash.util import user_dir
 import electroncash.version
 
 from . import scheduler
-from . import when
 from .constants import *
+from .forecast import Forecast, ForecastEngine
+from .instrumentation import stats
+from .overdue import OverdueBacklog
 
 
 class SchedulerThreadJob:
+    """
+    Ticks once a second, and looks for due payments.  Ticks are scheduled on the monotonic clock, and any that are missed
+    are skipped rather than caught up on.  If the wall clock moves by a different amount than the monotonic clock, as when
+    the machine wakes from sleep or the system time is changed, the jump is reported and whatever became due in the
+    meantime is evaluated once.
+    """
+
     def __init__(self, plugin):
-        self.last_second_time = time.time()
-        self.last_minute_time = scheduler.roundTimeSeconds(time.time())
+        # Ticks are passed to the GUI thread through a signal, and any that arrive before it handles one are collapsed into it.
+        self.tick_lock = threading.Lock()
+        self.pending_tick_time = None
+
+        self.last_wall_time = time.time()
+        self.last_monotonic_time = time.monotonic()
+        self.next_tick_time = self.last_monotonic_time + TICK_INTERVAL
+        self.signalled_due_time = None
         
         self.plugin = weakref.proxy(plugin)
         
     def run(self):
         thread_current_time = time.time()
-        if thread_current_time - self.last_second_time > 1.0:
-            self.last_second_time += 1.0
+        monotonic_time = time.monotonic()
+        wall_clock_jump = (thread_current_time - self.last_wall_time) - (monotonic_time - self.last_monotonic_time)
+        self.last_wall_time, self.last_monotonic_time = thread_current_time, monotonic_time
 
-            if self.plugin.clock_window is not None:
-                self.plugin.clock_window.onTimeChanged(thread_current_time, self.plugin.clock)
-                
-            clock_current_time = self.plugin.clock.getTime()
-            for dialog in self.plugin.weak_dialogs:
-                if hasattr(dialog, "onTimeChanged"):
-                    dialog.onTimeChanged(clock_current_time)
+        tick_lateness = monotonic_time - self.next_tick_time
+        if abs(wall_clock_jump) > TIME_JUMP_THRESHOLD or tick_lateness > TIME_JUMP_THRESHOLD:
+            stats.increment("time_jumps")
+            stats.record_timing("time_jump", wall_clock_jump if abs(wall_clock_jump) > TIME_JUMP_THRESHOLD else tick_lateness)
+            # The due payments are looked for again, even if the earliest due time was already signalled.
+            self.signalled_due_time = None
+
+        if tick_lateness >= 0:
+            # Skip any missed ticks, keeping to the same schedule.
+            missed_tick_count = int(tick_lateness // TICK_INTERVAL)
+            if missed_tick_count:
+                stats.increment("missed_ticks", missed_tick_count)
+            self.next_tick_time += (missed_tick_count + 1) * TICK_INTERVAL
+
+            with self.tick_lock:
+                tick_pending = self.pending_tick_time is not None
+                self.pending_tick_time = thread_current_time
+            if tick_pending:
+                stats.increment("coalesced_ticks")
+            else:
+                self.plugin.signal_dummy.tick_signal.emit()
            
-        # NOTE: This will not work (correctly) with the fake clock, as minutes pass faster.
-        if thread_current_time - self.last_minute_time > 60.0:
-            self.last_minute_time += 60.0
-            
+        # Due payments are only looked for once the earliest next payment time of any open wallet is reached.  Once signalled,
+        # that time is not signalled again, the processing of the due payments is expected to move it forward.
+        next_due_time = self.plugin.next_due_time
+        if next_due_time is not None and next_due_time != self.signalled_due_time:
             clock_current_time = self.plugin.clock.getTime()
-            self.plugin.signal_dummy.due_payments_signal.emit(clock_current_time)
+            if clock_current_time >= next_due_time:
+                self.signalled_due_time = next_due_time
+                # How long after the payments became due, that it was noticed.
+                stats.record_timing("scheduler_lag", clock_current_time - next_due_time)
+                self.plugin.signal_dummy.due_payments_signal.emit(clock_current_time)
+
+    def take_pending_tick(self):
+        """ The time of the latest tick that has not yet been handled by the GUI thread, or None if there is none. """
+        with self.tick_lock:
+            thread_current_time = self.pending_tick_time
+            self.pending_tick_time = None
+        return thread_current_time
                 
                 
 class SignalDummy(QObject):
+    tick_signal = pyqtSignal()
     due_payments_signal = pyqtSignal([int])
+    due_payments_evaluated_signal = pyqtSignal([object])
+    autopay_completed_signal = pyqtSignal([object])
                     
                 
 class Plugin(BasePlugin):
@@ -67,7 +115,20 @@ class Plugin(BasePlugin):
         self.wallet_payment_lists = {}
         self.wallet_payment_action_dialogs = {}
         self.wallet_payment_editor_dialogs = {}
+        self.wallet_forecast_dialogs = {}
+        self.wallet_value_formatters = {}
         self.wallet_data = {}
+        self.wallet_due_queues = {}
+        self.wallet_next_due_times = {}
+        self.wallet_locks = {}
+        self.wallet_due_payment_timings = {}
+        self.wallet_forecast_engines = {}
+        self.wallet_autopay_futures = {}
+        self.wallet_autopay_locks = {}
+        # The data of closed wallets with automatic payments still being made, and those payments, by wallet name.
+        self.closing_wallet_data = {}
+        self.next_due_time = None
+        self.next_due_time_lock = threading.Lock()
         
         self.weak_dialogs = weakref.WeakSet()
         self.clock_window = None
@@ -77,11 +138,81 @@ class Plugin(BasePlugin):
         self.job = SchedulerThreadJob(self)
         
         self.signal_dummy = SignalDummy()
+        self.signal_dummy.tick_signal.connect(self.on_tick_signal)
         self.signal_dummy.due_payments_signal.connect(self.on_due_payments_signal)
+        self.signal_dummy.due_payments_evaluated_signal.connect(self.on_due_payments_evaluated_signal)
+        self.signal_dummy.autopay_completed_signal.connect(self.on_autopay_completed_signal)
+
+        # The due payments of each wallet are evaluated and saved off the GUI thread, so that one wallet that is slow to do
+        # so does not hold up the others.
+        self.due_payments_executor = concurrent.futures.ThreadPoolExecutor(max_workers=DUE_PAYMENTS_WORKER_COUNT)
+
+        # Automatic payments are made off the GUI thread, as a slow server would otherwise freeze the wallet windows.
+        self.autopay_executor = concurrent.futures.ThreadPoolExecutor(max_workers=AUTOPAY_WORKER_COUNT)
         
+    def on_tick_signal(self):
+        """ Relay the latest tick of the scheduler thread job to the windows that show time dependent values. """
+        thread_current_time = self.job.take_pending_tick()
+        if thread_current_time is None:
+            return
+
+        if self.clock_window is not None:
+            self.clock_window.onTimeChanged(thread_current_time, self.clock)
+
+        # Only the dialogs showing an estimate that the passing of time has made out of date, need to be updated.
+        clock_current_time = self.clock.getTime()
+        for dialog in list(self.weak_dialogs):
+            if hasattr(dialog, "onTimeChanged") and dialog.is_estimate_expired(clock_current_time):
+                dialog.onTimeChanged(clock_current_time)
+
     def on_due_payments_signal(self, clock_current_time):
         for wallet_name in self.get_open_wallet_names():
-            self.process_due_payments(wallet_name, current_time=clock_current_time)
+            self.submit_due_payments(wallet_name, clock_current_time)
+
+    def submit_due_payments(self, wallet_name, current_time):
+        """ Evaluate the due payments of a wallet on a worker thread, and complete the processing back on the GUI thread. """
+        submit_time = time.perf_counter()
+        def evaluate_due_payments():
+            start_time = time.perf_counter()
+            result = self.evaluate_due_payments(wallet_name, current_time)
+            return result, start_time, time.perf_counter()
+        future = self.due_payments_executor.submit(evaluate_due_payments)
+        future.add_done_callback(lambda future: self.signal_dummy.due_payments_evaluated_signal.emit((wallet_name, future, submit_time)))
+
+    def on_due_payments_evaluated_signal(self, args):
+        wallet_name, future, submit_time = args
+        try:
+            result, start_time, end_time = future.result()
+        except Exception:
+            # Whatever went wrong should not be raised out of the Qt slot, and the wallet's other payments carry on.
+            self.print_error("due payments for '%s': evaluation failed" % wallet_name)
+            traceback.print_exc()
+            return
+        if result is not None:
+            self.complete_due_payments(wallet_name, *result)
+
+        # Report how long each stage took for each wallet.
+        timings = start_time - submit_time, end_time - start_time, time.perf_counter() - submit_time
+        self.wallet_due_payment_timings[wallet_name] = timings
+        stats.record_timing("process_due_payments", timings[2])
+        # Most ticks find nothing due, and logging those would only bury the ones that did.
+        if result is not None:
+            self.print_error("due payments for '%s': %d due, queued %.1f ms, evaluated %.1f ms, completed after %.1f ms" % (wallet_name,
+                len(result[0]), timings[0] * 1000, timings[1] * 1000, timings[2] * 1000))
+
+    def update_next_due_time(self, wallet_name):
+        """
+        Called whenever the due queue of a wallet changes, so that the scheduler thread job knows when to next look for due
+        payments.  This may be called from the due payment worker threads, with the lock of the given wallet held.
+        """
+        due_queue = self.wallet_due_queues.get(wallet_name, None)
+        with self.next_due_time_lock:
+            if due_queue is None:
+                self.wallet_next_due_times.pop(wallet_name, None)
+            else:
+                self.wallet_next_due_times[wallet_name] = due_queue.peekTime()
+            due_times = [ due_time for due_time in self.wallet_next_due_times.values() if due_time is not None ]
+            self.next_due_time = min(due_times) if len(due_times) else None
     
     def fullname(self):
         return 'Scheduled Payments'
@@ -108,14 +239,23 @@ class Plugin(BasePlugin):
             self.close_wallet(window.wallet)
             
         self.close_clock_window()
+        self.due_payments_executor.shutdown(wait=False)
+        self.autopay_executor.shutdown(wait=False)
         
     @hook
     def update_contact(self, address, new_entry, old_entry):
-        print("update_contact", address, new_entry, old_entry)
+        self.on_contacts_changed([ address ])
 
     @hook
     def delete_contacts(self, contact_entries):
-        print("delete_contacts", contact_entries)
+        self.on_contacts_changed(contact_entries)
+
+    def on_contacts_changed(self, addresses):
+        """ The displayed contact labels for the given addresses are no longer correct. """
+        addresses = [ str(address) for address in addresses ]
+        for wallet_name, value_formatter in self.wallet_value_formatters.items():
+            value_formatter.invalidate_addresses(addresses)
+            self.wallet_payment_lists[wallet_name].update_addresses(addresses)
             
     @hook
     def init_qt(self, qt_gui):
@@ -151,20 +291,32 @@ class Plugin(BasePlugin):
     def close_wallet(self, wallet):
         wallet_name = wallet.basename()
         window = self.wallet_windows[wallet_name]
+        # The data is unloaded while the window is still known, as this waits for any evaluation of the wallet's due
+        # payments on a worker thread, and that looks at the window.
+        self.unload_data_for_wallet(wallet_name)
         del self.wallet_windows[wallet_name]
 
         self.remove_ui_for_wallet(wallet_name, window)
-        self.unload_data_for_wallet(wallet_name)
         
         if len(self.wallet_windows) == 0:
             self.close_clock_window()
             
     def get_due_payments_for_wallet(self, wallet_name, current_time):
-        matches = []
-        for payment_data in self.get_wallet_payments(wallet_name):
-            if payment_data[PAYMENT_DATENEXTPAID] <= current_time:
-                matches.append(payment_data)
-        return matches
+        due_payment_ids = self.wallet_due_queues[wallet_name].getDue(current_time)
+        return self.get_wallet_payments_by_id(wallet_name, due_payment_ids)
+
+    def pop_due_payments_for_wallet(self, wallet_name, current_time):
+        """ The due payments are removed from the due queue, and are expected to be requeued by dispatch_due_payment. """
+        due_payment_ids = self.wallet_due_queues[wallet_name].popDue(current_time)
+        return self.get_wallet_payments_by_id(wallet_name, due_payment_ids)
+
+    def get_wallet_payment(self, wallet_name, payment_id):
+        return self.wallet_data[wallet_name].get_payment(payment_id)
+
+    def get_wallet_payments_by_id(self, wallet_name, payment_ids):
+        wallet_data = self.wallet_data[wallet_name]
+        payment_entries = [ wallet_data.get_payment(payment_id) for payment_id in payment_ids ]
+        return [ payment_data for payment_data in payment_entries if payment_data is not None ]
             
     def get_due_payments(self, current_time):
         matches = []
@@ -178,87 +330,156 @@ class Plugin(BasePlugin):
         """ When a wallet is loaded, detect if payments have become overdue. """        
         if current_time is None:
             current_time = self.clock.getTime()
-        
-        due_payment_entries = self.get_due_payments_for_wallet(wallet_name, current_time)
-        if not len(due_payment_entries):
-            return
 
-        deferred_results = []
-        for payment_data in due_payment_entries:
-            result = self.dispatch_due_payment(wallet_name, payment_data, current_time, defer_for_batching=True)
+        with stats.timed("process_due_payments"):
+            result = self.evaluate_due_payments(wallet_name, current_time)
             if result is not None:
-                deferred_results.append(result)
+                self.complete_due_payments(wallet_name, *result, on_wallet_loaded=on_wallet_loaded)
 
-        wallet_data = self.wallet_data[wallet_name]
-        wallet_data.save()
-        
+    def evaluate_due_payments(self, wallet_name, current_time):
+        """
+        Update the payments of a wallet that have become due, and save them.  This does not touch the UI, so that it can be
+        done on a worker thread.  Returns the ids of the due payments and those to pay automatically, or None if there are
+        none or the wallet has been closed.
+        """
+        wallet_lock = self.wallet_locks.get(wallet_name, None)
+        if wallet_lock is None:
+            return
+        with wallet_lock:
+            wallet_data = self.wallet_data.get(wallet_name, None)
+            if wallet_data is None:
+                return
+
+            due_payment_entries = self.pop_due_payments_for_wallet(wallet_name, current_time)
+            if not len(due_payment_entries):
+                return
+            stats.increment("due_payments", len(due_payment_entries))
+            evaluation_start_time = time.perf_counter()
+
+            try:
+                # The missed occurrences are counted rather than generated, however long the wallet has been closed for.
+                overdue_occurrences = []
+                for payment_data in due_payment_entries:
+                    estimation_start_time = self.get_estimation_start_time(payment_data)
+                    overdue_count = scheduler.countOccurrences(payment_data.when, estimation_start_time, current_time)
+                    overdue_first_time = scheduler.getNthOccurrence(payment_data.when, estimation_start_time, 0) if overdue_count else None
+                    overdue_occurrences.append((overdue_first_time, overdue_count))
+
+                # The payment changes are written to the wallet storage once.
+                with wallet_data.transaction():
+                    deferred_results = []
+                    for payment_data, payment_overdue_occurrences in zip(due_payment_entries, overdue_occurrences):
+                        result = self.dispatch_due_payment(wallet_name, payment_data, current_time, defer_for_batching=True, overdue_occurrences=payment_overdue_occurrences)
+                        if result is not None:
+                            deferred_results.append(result)
+
+                    self.update_next_due_time(wallet_name)
+                    wallet_data.save()
+            except Exception:
+                # Put the due payments back, so that they are not lost and are evaluated again on the next tick.
+                due_queue = self.wallet_due_queues[wallet_name]
+                for payment_data in due_payment_entries:
+                    due_queue.setDueTime(payment_data.id, payment_data.date_next_paid)
+                self.update_next_due_time(wallet_name)
+                raise
+        stats.record_timing("evaluate_due_payments", time.perf_counter() - evaluation_start_time)
+
+        due_payment_ids = [ payment_data.id for payment_data in due_payment_entries ]
+        return due_payment_ids, deferred_results
+
+    def complete_due_payments(self, wallet_name, due_payment_ids, deferred_results, on_wallet_loaded=False):
+        """ Called on the GUI thread, to pay the evaluated due payments that should be, and let the user know about the rest. """
+        if wallet_name not in self.wallet_data:
+            return
+
+        # The user is told about these when the payment attempt completes.
         if len(deferred_results):
-            txid = self.autopay_payments(wallet_name, deferred_results)
-            # Note if the payments were deferred for some reason, because payment failed.
-            if txid is None:
-                deferred_results = []
+            self.autopay_payments(wallet_name, deferred_results)
 
         # This is already done by the wallet loading code.
         if not on_wallet_loaded:
-            self.refresh_ui_for_wallet(wallet_name)
+            self.refresh_ui_for_wallet(wallet_name, due_payment_ids)
 
-        window = self.wallet_windows[wallet_name]
-        paid_payment_ids = set(payment_data[PAYMENT_ID] for payment_data, amount in deferred_results)
-        if len(paid_payment_ids) > 0:
-            s = wallet_name +": "
-            if len(paid_payment_ids) == 1:
-                s += _("1 scheduled payment was made.")
-            else:
-                s += _("%d scheduled payments were made.") % len(paid_payment_ids)
-            window.notify(s)
-        due_payment_ids = set(payment_data[PAYMENT_ID] for payment_data in due_payment_entries).difference(paid_payment_ids)
-        if len(due_payment_ids) > 0:
+        autopay_payment_ids = set(payment_data.id for payment_data, overdue_first_time, overdue_count in deferred_results)
+        due_payment_ids = set(due_payment_ids).difference(autopay_payment_ids)
+        self.notify_due_payments(wallet_name, len(due_payment_ids))
+
+    def notify_due_payments(self, wallet_name, due_count):
+        if due_count > 0:
             s = wallet_name +": "
-            if len(due_payment_ids) == 1:
+            if due_count == 1:
                 s += _("1 scheduled payment became due.")
             else:
-                s += _("%d scheduled payments became due.") % len(due_payment_ids)
+                s += _("%d scheduled payments became due.") % due_count
             s += " "+ _("Check the scheduled payments tab.")
-            window.notify(s)
+            self.wallet_windows[wallet_name].notify(s)
+
+    def notify_paid_payments(self, wallet_name, paid_count):
+        if paid_count > 0:
+            s = wallet_name +": "
+            if paid_count == 1:
+                s += _("1 scheduled payment was made.")
+            else:
+                s += _("%d scheduled payments were made.") % paid_count
+            self.wallet_windows[wallet_name].notify(s)
         
-    def dispatch_due_payment(self, wallet_name, payment_data, current_time, defer_for_batching=False):
-        """ Either automatically pay, or put into overdue status, a due payment. """
-        deferred_result = None
-        payment_when = when.When.fromText(payment_data[PAYMENT_WHEN])
+    def get_estimation_start_time(self, payment_data):
+        """ The point in time after which occurrences of a payment have not yet been accounted for. """
         relevant_start_times = []
-        if payment_data[PAYMENT_DATELASTPAID] is not None:
-            relevant_start_times.append(payment_data[PAYMENT_DATELASTPAID])
-        relevant_start_times.append(payment_data[PAYMENT_DATEUPDATED])
-        estimation_start_time = max(relevant_start_times)
-        estimator = scheduler.WhenEstimator(estimation_start_time, payment_when)
-        overdue_payment_times = estimator.getNextOccurrences(maxMatches=100, maxTime=current_time)
-        if self.should_autopay_payment(wallet_name, payment_data):
+        if payment_data.date_last_paid is not None:
+            relevant_start_times.append(payment_data.date_last_paid)
+        relevant_start_times.append(payment_data.date_updated)
+        return max(relevant_start_times)
+
+    def dispatch_due_payment(self, wallet_name, payment_data, current_time, defer_for_batching=False, overdue_occurrences=None):
+        """
+        Either automatically pay, or put into overdue status, a due payment.  The overdue occurrences are given as the time
+        of the first one and how many there are, and are worked out if not provided.
+        """
+        deferred_result = None
+        payment_when = payment_data.when
+        if overdue_occurrences is None:
+            estimation_start_time = self.get_estimation_start_time(payment_data)
+            overdue_count = scheduler.countOccurrences(payment_when, estimation_start_time, current_time)
+            overdue_first_time = scheduler.getNthOccurrence(payment_when, estimation_start_time, 0) if overdue_count else None
+        else:
+            overdue_first_time, overdue_count = overdue_occurrences
+        if overdue_count == 0:
+            pass
+        elif self.should_autopay_payment(wallet_name, payment_data):
+            # Until the payment is known to have been made, the occurrences are recorded as overdue, and saved along with
+            # the moved on update time.  That way they are not lost if the wallet is closed first.
+            self.remember_overdue_payment_occurrences(payment_data, overdue_first_time, overdue_count)
             if defer_for_batching:
-                deferred_result = payment_data, overdue_payment_times
+                deferred_result = payment_data, overdue_first_time, overdue_count
             else:
-                # If this fails, the payments will have become overdue instead.
-                self.autopay_payments(wallet_name, [(payment_data, overdue_payment_times)])
+                # If this fails, the occurrences just recorded as overdue remain so.
+                self.autopay_payments(wallet_name, [(payment_data, overdue_first_time, overdue_count)])
         else:
-            self.remember_overdue_payment_occurrences( payment_data, overdue_payment_times)
+            self.remember_overdue_payment_occurrences(payment_data, overdue_first_time, overdue_count)
         # This sets the new time marker for what is considered overdue.
-        payment_data[PAYMENT_DATEUPDATED] = current_time
+        payment_data.date_updated = current_time
         # Calculate the time of the next payment in the future.
-        estimator = scheduler.WhenEstimator(current_time, payment_when)            
-        future_payment_times = estimator.getNextOccurrences(maxMatches=1)
-        payment_data[PAYMENT_DATENEXTPAID] = future_payment_times[0]
+        payment_data.date_next_paid = scheduler.getNthOccurrence(payment_when, current_time, 0)
+        self.wallet_due_queues[wallet_name].setDueTime(payment_data.id, payment_data.date_next_paid)
         return deferred_result
         
     def should_autopay_payment(self, wallet_name, payment_data):
         """ Whether a payment in a wallet should be paid automatically, rather than simply marked as an unpaid occurrence. """
         window = self.wallet_windows.get(wallet_name, None)
+        if window is None:
+            return False
         if not window.wallet.has_password() and window.config.fee_per_kb() is not None:
-            if payment_data[PAYMENT_FLAGS] is not None:
-                return payment_data[PAYMENT_FLAGS] & PAYMENT_FLAG_AUTOPAY == PAYMENT_FLAG_AUTOPAY
+            return payment_data.flags & PAYMENT_FLAG_AUTOPAY == PAYMENT_FLAG_AUTOPAY
         return False
 
     def autopay_payments(self, wallet_name, payment_entries):
-        """ For unencrypted wallets, the option is (will be) there to make the payments automatically, rather than simply mark them as unpaid occurrences. """
-        # payment_entries = [ (payment_data, overdue_payment_times), ... ]
+        """
+        For unencrypted wallets, the option is there to make the payments automatically, rather than simply mark them as
+        unpaid occurrences.  The transaction is made and broadcast by a worker thread, and the outcome is applied to the
+        payments by on_autopay_completed() on the GUI thread.
+        """
+        # payment_entries = [ (payment_data, overdue_first_time, overdue_count), ... ]
         
         wallet_window = self.wallet_windows[wallet_name]
         wallet = wallet_window.wallet
@@ -266,37 +487,101 @@ class Plugin(BasePlugin):
         network = wallet_window.network
         
         outputs = []
-        for payment_data, overdue_payment_times in payment_entries:
-            totalSatoshis = len(overdue_payment_times) * payment_data[PAYMENT_AMOUNT]
-            address = Address.from_string(payment_data[PAYMENT_ADDRESS])
+        for payment_data, overdue_first_time, overdue_count in payment_entries:
+            totalSatoshis = overdue_count * payment_data.amount
+            address = Address.from_string(payment_data.address)
             outputs.append((TYPE_ADDRESS, address, totalSatoshis))        
 
-        password = None
-        tx = wallet.mktx(outputs, password, wallet_window.config)
-        status, data = network.broadcast(tx)
-        
-        if status:
-            # data is txid.
-            return data
-        # data is error message
+        # The payments may be edited or deleted before the payment completes, so only their ids are passed along.  The
+        # occurrence times are those of the when at the time of submission, so that is passed along with them.
+        payment_entries = [ (payment_data.id, payment_data.when, overdue_first_time, overdue_count) for payment_data, overdue_first_time, overdue_count in payment_entries ]
+        autopay_lock = self.wallet_autopay_locks[wallet_name]
+        def make_transaction():
+            # The payments of a wallet are made one at a time, as they would otherwise choose the same coins to spend.
+            with autopay_lock:
+                return make_autopay_transaction(wallet, config, network, outputs)
+        future = self.autopay_executor.submit(make_transaction)
+        # This is registered first, as a future that is already done calls back straight away.
+        self.wallet_autopay_futures[wallet_name][future] = payment_entries
+        future.add_done_callback(lambda future: self.signal_dummy.autopay_completed_signal.emit((wallet_name, payment_entries, future)))
+
+    def on_autopay_completed_signal(self, args):
+        self.on_autopay_completed(*args)
+
+    def on_autopay_completed(self, wallet_name, payment_entries, future):
+        """ Record the outcome of an automatic payment, and let the user know about it. """
+        autopay_futures = self.wallet_autopay_futures.get(wallet_name, None)
+        if autopay_futures is None or autopay_futures.pop(future, None) is None:
+            # The wallet was closed before the payment completed, and if it was started its outcome is recorded in the
+            # closed wallet's data, which is written and let go of once the last of its automatic payments completes.
+            wallet_data, autopay_futures = self.closing_wallet_data.get(wallet_name, (None, {}))
+            if autopay_futures.pop(future, None) is not None:
+                self.apply_autopay_outcome(wallet_name, payment_entries, future, wallet_data)
+                if not len(autopay_futures):
+                    wallet_data.flush()
+                    del self.closing_wallet_data[wallet_name]
+            return
 
-        # Fallback to remembering the overdue payments.
-        # TODO: Alert the user about the failure - best way is to mark the payment.
-        for payment_data, overdue_payment_times in payment_entries:
-            self.remember_overdue_payment_occurrences( payment_data, overdue_payment_times)
+        txid, payment_ids = self.apply_autopay_outcome(wallet_name, payment_entries, future)
+        self.refresh_ui_for_wallet(wallet_name, payment_ids)
+        if txid is not None:
+            self.notify_paid_payments(wallet_name, len(payment_ids))
+        else:
+            self.notify_due_payments(wallet_name, len(payment_ids))
         
-    def remember_overdue_payment_occurrences(self, payment_data, overdue_payment_times):
-        """ Record the newly identified overdue payment occurrences. """
-        for overdue_payment_time in overdue_payment_times:
-            if overdue_payment_time not in payment_data[PAYMENT_DATESOVERDUE]:
-                payment_data[PAYMENT_DATESOVERDUE].append(overdue_payment_time)
+    def apply_autopay_outcome(self, wallet_name, payment_entries, future, wallet_data=None):
+        """
+        Record the outcome of an automatic payment.  The occurrences it was for were recorded as overdue when it was made,
+        and if it succeeded they are forgotten again and the payments marked as paid.  Returns the id of the transaction
+        or None if it failed, and the ids of the payments that still exist.  The data is that of the open wallet, unless
+        that of a closed one is given.
+        """
+        if wallet_data is None:
+            wallet_data = self.wallet_data[wallet_name]
+        txid, error_message = future.result()
+        stats.increment("autopay_succeeded" if txid is not None else "autopay_failed")
+        with self.get_wallet_lock(wallet_name), wallet_data.transaction():
+            payment_ids = []
+            for payment_id, payment_when, overdue_first_time, overdue_count in payment_entries:
+                payment_data = wallet_data.get_payment(payment_id)
+                if payment_data is None:
+                    continue
+                if txid is not None:
+                    payment_data.txid_last_paid = txid
+                    payment_data.date_last_paid = scheduler.getNthOccurrence(payment_when, overdue_first_time, overdue_count - 2) if overdue_count > 1 else overdue_first_time
+                    overdue_times = itertools.islice(scheduler.iterOccurrences(payment_when, overdue_first_time), overdue_count - 1)
+                    for overdue_time in itertools.chain([ overdue_first_time ], overdue_times):
+                        payment_data.dates_overdue.discard(overdue_time)
+                # TODO: Alert the user about a failure - best way is to mark the payment.
+                payment_ids.append(payment_id)
+            wallet_data.save()
+        return txid, payment_ids
+
+    def get_autopay_occurrence_times(self, wallet_name):
+        """
+        The occurrence times that the automatic payments being made for a wallet are paying, by payment id.  These are in
+        the overdue backlogs of their payments until the outcome is known, but are not for the user to pay or forget.
+        """
+        occurrence_times_by_id = {}
+        for payment_entries in self.wallet_autopay_futures.get(wallet_name, {}).values():
+            for payment_id, payment_when, overdue_first_time, overdue_count in payment_entries:
+                occurrence_times = occurrence_times_by_id.setdefault(payment_id, set())
+                occurrence_times.add(overdue_first_time)
+                occurrence_times.update(itertools.islice(scheduler.iterOccurrences(payment_when, overdue_first_time), overdue_count - 1))
+        return occurrence_times_by_id
+
+    def remember_overdue_payment_occurrences(self, payment_data, overdue_first_time, overdue_count, payment_when=None):
+        """
+        Record the newly identified overdue payment occurrences, the given number of them from the first time.  These are
+        occurrences of the given when, which is the payment's current when if not given.
+        """
+        if payment_when is None:
+            payment_when = payment_data.when
+        payment_data.dates_overdue.addRun(overdue_first_time, payment_when, overdue_count)
         
     def check_payments_overdue(self, wallet_name, payment_ids):
-        wallet_data = self.wallet_data[wallet_name]
-        payment_entries = wallet_data.get(PAYMENT_DATA_KEY, [])
-        
-        for payment_data in payment_entries:
-            if payment_data[PAYMENT_ID] in payment_ids and len(payment_data[PAYMENT_DATESOVERDUE]):
+        for payment_data in self.get_wallet_payments_by_id(wallet_name, payment_ids):
+            if len(payment_data.dates_overdue):
                 return True
         return False
         
@@ -311,8 +596,8 @@ class Plugin(BasePlugin):
         totalSatoshis = 0.0
         addresses = []
         for occurrence_count, payment_data in matches:
-            totalSatoshis += occurrence_count * payment_data[PAYMENT_AMOUNT]
-            address = payment_data[PAYMENT_ADDRESS]
+            totalSatoshis += occurrence_count * payment_data.amount
+            address = payment_data.address
             
             contact_name = None
             if address in wallet_window.contacts.keys():
@@ -330,36 +615,42 @@ class Plugin(BasePlugin):
         if len(matches) == 1:
             match = matches[0]
             payment_data = match[1]
-            wallet_window.message_e.setText(payment_data[PAYMENT_DESCRIPTION].strip() or _("Scheduled payment"))
+            wallet_window.message_e.setText(payment_data.description.strip() or _("Scheduled payment"))
         else:
             wallet_window.message_e.setText(_("Scheduled payments"))
                     
     def forget_overdue_payment_occurrences(self, wallet_name, payment_occurrence_keys, mark_paid=False):
         wallet_data = self.wallet_data[wallet_name]
-        payment_entries = wallet_data.get(PAYMENT_DATA_KEY, [])
 
-        # Clear the overdue dates from any payments that have them.
+        occurrence_times_by_id = {}
+        for payment_id, occurrence_time in payment_occurrence_keys:
+            occurrence_times_by_id.setdefault(payment_id, []).append(occurrence_time)
+
+        # Clear the overdue dates from any payments that have them, other than those being paid automatically.
+        autopay_occurrence_times_by_id = self.get_autopay_occurrence_times(wallet_name)
         matches = []
-        for payment_data in payment_entries:
-            forget_count = 0
-            occurrence_times = [ k[1] for k in payment_occurrence_keys if k[0] == payment_data[PAYMENT_ID] ]
-            forget_times = []
-            for forget_time in occurrence_times:
-                if forget_time in payment_data[PAYMENT_DATESOVERDUE]:
-                    payment_data[PAYMENT_DATESOVERDUE].remove(forget_time)
-                    forget_times.append(forget_time)
-            if len(forget_times):
-                if mark_paid:
-                    payment_data[PAYMENT_DATELASTPAID] = max(forget_times)
-                matches.append((len(forget_times), payment_data))
-
-        wallet_data.save()        
-        self.refresh_ui_for_wallet(wallet_name)
+        with self.wallet_locks[wallet_name]:
+            for payment_data in self.get_wallet_payments_by_id(wallet_name, occurrence_times_by_id.keys()):
+                occurrence_times = occurrence_times_by_id[payment_data.id]
+                autopay_occurrence_times = autopay_occurrence_times_by_id.get(payment_data.id, ())
+                forget_times = []
+                for forget_time in occurrence_times:
+                    if forget_time not in autopay_occurrence_times and payment_data.dates_overdue.discard(forget_time):
+                        forget_times.append(forget_time)
+                if len(forget_times):
+                    if mark_paid:
+                        payment_data.date_last_paid = max(forget_times)
+                    matches.append((len(forget_times), payment_data))
+
+            wallet_data.save()        
+        self.refresh_ui_for_wallet(wallet_name, occurrence_times_by_id.keys())
         
         return matches
          
     def add_ui_for_wallet(self, wallet_name, window):
         from .payments_list import ScheduledPaymentsList
+        from .util import ValueFormatter
+        self.wallet_value_formatters[wallet_name] = ValueFormatter(window)
         l = ScheduledPaymentsList(window, self, wallet_name)
         
         tab = window.create_list_tab(l)
@@ -380,6 +671,10 @@ class Plugin(BasePlugin):
                 del self.wallet_payment_editor_dialogs[wallet_name][payment_id]
                 dialog.close()
             del self.wallet_payment_editor_dialogs[wallet_name]
+
+        dialog = self.wallet_forecast_dialogs.pop(wallet_name, None)
+        if dialog is not None:
+            dialog.close()
             
         wallet_tab = self.wallet_payment_tabs.get(wallet_name, None)
         if wallet_tab is not None:        
@@ -387,6 +682,7 @@ class Plugin(BasePlugin):
             del self.wallet_payment_tabs[wallet_name]
             i = window.tabs.indexOf(wallet_tab)
             window.tabs.removeTab(i)
+        self.wallet_value_formatters.pop(wallet_name, None)
 
     def load_data_for_wallet(self, wallet_name, window):
         from .data_store import DataStore
@@ -395,34 +691,66 @@ class Plugin(BasePlugin):
 
         if False:
             # HACK TODO to trigger wallet open due payment detection case
-            for payment_data in wallet_data.get(PAYMENT_DATA_KEY, []):
-                payment_data[PAYMENT_DATESOVERDUE] = []
-                payment_data[PAYMENT_DATEUPDATED] = 1525335600 - 10000
-                payment_data[PAYMENT_DATENEXTPAID] = 1525335600        
+            for payment_data in wallet_data.payments.values():
+                payment_data.dates_overdue = OverdueBacklog()
+                payment_data.date_updated = 1525335600 - 10000
+                payment_data.date_next_paid = 1525335600        
+
+        due_queue = scheduler.DueQueue()
+        for payment_data in wallet_data.payments.values():
+            due_queue.setDueTime(payment_data.id, payment_data.date_next_paid)
+        self.wallet_due_queues[wallet_name] = due_queue
+        self.wallet_forecast_engines[wallet_name] = ForecastEngine()
+        self.wallet_autopay_futures[wallet_name] = {}
+        self.wallet_autopay_locks[wallet_name] = threading.Lock()
+        self.wallet_locks[wallet_name] = threading.RLock()
+        self.update_next_due_time(wallet_name)
+
+        # If the wallet was reopened before the automatic payments it was closing with completed, their outcomes are
+        # recorded in the data that has just been loaded instead, which has their occurrences as overdue.
+        closing_wallet_data, autopay_futures = self.closing_wallet_data.pop(wallet_name, (None, {}))
+        self.wallet_autopay_futures[wallet_name].update(autopay_futures)
         
     def unload_data_for_wallet(self, wallet_name):
-        wallet_data = self.wallet_data.get(wallet_name, None)
-        if wallet_data is not None:
-            del self.wallet_data[wallet_name]
-
-    def refresh_ui_for_wallet(self, wallet_name):
-        wallet_tab = self.wallet_payment_tabs[wallet_name]
-        wallet_tab.update()
-        wallet_tab = self.wallet_payment_lists[wallet_name]
-        wallet_tab.update()
-
-    def correct_payment_data(self, payment_data):
-        if payment_data is None:
-            return            
-        while len(payment_data) < PAYMENT_ENTRY_LENGTH:
-            payment_data.append(None)
-    
+        # This waits for any evaluation of the wallet's due payments on a worker thread to finish.
+        with self.wallet_locks.get(wallet_name, threading.RLock()):
+            wallet_data = self.wallet_data.get(wallet_name, None)
+            # Automatic payments that have not been started are abandoned, leaving their occurrences overdue.  Those that
+            # have are not waited for, rather the wallet is left closing and on_autopay_completed() records whether they
+            # were made.
+            self.wallet_autopay_locks.pop(wallet_name, None)
+            autopay_futures = self.wallet_autopay_futures.pop(wallet_name, {})
+            autopay_futures = { future: payment_entries for future, payment_entries in autopay_futures.items() if not future.cancel() }
+            if wallet_data is not None:
+                # Anything changed but not yet written, has to be written before the wallet storage is closed.
+                wallet_data.flush()
+                del self.wallet_data[wallet_name]
+                if len(autopay_futures):
+                    self.closing_wallet_data[wallet_name] = wallet_data, autopay_futures
+            self.wallet_due_queues.pop(wallet_name, None)
+            self.wallet_forecast_engines.pop(wallet_name, None)
+            self.update_next_due_time(wallet_name)
+            self.wallet_locks.pop(wallet_name, None)
+
+    def refresh_ui_for_wallet(self, wallet_name, payment_ids=None):
+        """ Update the payments list for the given changed payments, or for all of them if they are not known. """
+        payments_list = self.wallet_payment_lists[wallet_name]
+        payments_list.update_payments(payment_ids)
+
+        # The overdue occurrences being paid or forgotten may have changed.
+        dialog = self.wallet_payment_action_dialogs.get(wallet_name, None)
+        if dialog is not None:
+            dialog.refresh()
+
+        # Any forecast that includes this wallet may have changed.
+        for dialog in list(self.wallet_forecast_dialogs.values()):
+            if dialog.wallet_name == wallet_name or dialog.includes_all_wallets():
+                dialog.update_forecast()
+
     def open_payment_editor(self, wallet_name, entry=None):
         payment_id = None
         if entry is not None:
-            payment_id = entry[PAYMENT_ID]
-            
-        self.correct_payment_data(entry)
+            payment_id = entry.id
             
         dialog = None
         if  wallet_name in self.wallet_payment_editor_dialogs:
@@ -471,18 +799,65 @@ class Plugin(BasePlugin):
     def on_payment_action_window_closed(self, wallet_name):
         if wallet_name in self.wallet_payment_action_dialogs:
             del self.wallet_payment_action_dialogs[wallet_name]
-        
+
+    def open_forecast_window(self, wallet_name):
+        dialog = self.wallet_forecast_dialogs.get(wallet_name, None)
+        if dialog is None:
+            window = self.wallet_windows[wallet_name]
+            import importlib
+            from . import forecast_dialog
+            importlib.reload(forecast_dialog)
+            dialog = forecast_dialog.ForecastDialog(window, self, wallet_name)
+            self.wallet_forecast_dialogs[wallet_name] = dialog
+            dialog.show()
+        else:
+            dialog.raise_()
+            dialog.activateWindow()
+            dialog.show()
+
+    def on_forecast_window_closed(self, wallet_name):
+        self.wallet_forecast_dialogs.pop(wallet_name, None)
+
+    def get_forecast(self, period, days, wallet_name=None, current_time=None):
+        """
+        How much the scheduled payments of the given wallet, or of all the open wallets if not given, are due to pay out
+        over the given number of days from now, in buckets of the given period.
+        """
+        if current_time is None:
+            current_time = self.clock.getTime()
+        end_time = current_time + days * 24 * 60 * 60
+        wallet_names = self.get_open_wallet_names() if wallet_name is None else [ wallet_name ]
+        if len(wallet_names) == 1:
+            return self.get_wallet_forecast(wallet_names[0], period, current_time, end_time)
+        forecast = Forecast(period, int(current_time) // 60 * 60, int(end_time) // 60 * 60)
+        for wallet_name in wallet_names:
+            forecast.merge(self.get_wallet_forecast(wallet_name, period, current_time, end_time))
+        return forecast
+
+    def get_wallet_forecast(self, wallet_name, period, start_time, end_time):
+        # The payments are not changed while they are being forecast.
+        with self.wallet_locks[wallet_name]:
+            payments = list(self.get_wallet_payments(wallet_name))
+            return self.wallet_forecast_engines[wallet_name].get_forecast(payments, period, start_time, end_time)
+        
+    def get_value_formatter(self, wallet_name):
+        """ The formatter shared by the lists and dialogs of a wallet, so that they share its cached formatted values. """
+        return self.wallet_value_formatters[wallet_name]
+
     def get_wallet(self, wallet_name):
         return self.wallet_windows[wallet_name].wallet
+
+    def get_wallet_lock(self, wallet_name):
+        """ The payments of a wallet are changed by the due payment workers, so the UI only reads them holding this. """
+        return self.wallet_locks.get(wallet_name, None) or threading.RLock()
         
     def get_open_wallet_names(self):
         return list(self.wallet_windows.keys())
     
     def get_wallet_payments(self, wallet_name):
-        """ Called by SchedularPaymentsList.on_update() when update() is called on it. """
+        """ Called by ScheduledPaymentsModel.update_payments() when the payments list is refreshed. """
         wallet_data = self.wallet_data[wallet_name]
-        payment_entries = wallet_data.get(PAYMENT_DATA_KEY, [])
-        return payment_entries
+        return wallet_data.payments.values()
         
     def toggle_clock_window(self, wallet_name):
         if self.clock_window is None:
@@ -521,14 +896,7 @@ class Plugin(BasePlugin):
                 
     def open_edit_payment_dialog(self, wallet_name, payment_id):
         wallet_data = self.wallet_data[wallet_name]
-        payment_entries = wallet_data.get(PAYMENT_DATA_KEY, [])
-        
-        target_entry = None
-        for entry in payment_entries:
-            if entry[PAYMENT_ID] == payment_id:
-                target_entry = entry
-                break
-
+        target_entry = wallet_data.get_payment(payment_id)
         if target_entry is not None:
             self.open_payment_editor(wallet_name, target_entry)
             
@@ -537,38 +905,55 @@ class Plugin(BasePlugin):
         Called by the scheduled payment dialog when a payment is created/or saved.
         """
         wallet_data = self.wallet_data[wallet_name]
-        payment_entries = wallet_data.get(PAYMENT_DATA_KEY, [])
-        
-        self.correct_payment_data(payment_data)
             
-        if payment_data[PAYMENT_ID] is None:
-            # Finish initialising the new payment and add it to the list.
-            payment_data[PAYMENT_ID] = uuid.uuid4().hex
-            payment_data[PAYMENT_DATECREATED] = int(self.clock.getTime())
-            payment_data[PAYMENT_DATESOVERDUE] = []
-            payment_entries.append(payment_data)
-        else:
-            # Replace the old version with the new version.
-            for i, entry in enumerate(payment_entries):
-                if entry[PAYMENT_ID] == payment_data[PAYMENT_ID]:
-                    payment_data[PAYMENT_DATECREATED] = entry[PAYMENT_DATECREATED]
-                    payment_data[PAYMENT_DATELASTPAID] = entry[PAYMENT_DATELASTPAID]
-                    payment_data[PAYMENT_DATESOVERDUE] = entry[PAYMENT_DATESOVERDUE]
-                    payment_entries[i] = payment_data
-                    break
-                    
-        payment_data[PAYMENT_DATEUPDATED] = int(self.clock.getTime())
-        
-        wallet_data[PAYMENT_DATA_KEY] = payment_entries # This is expected to trigger the wallet data to save.        
-        self.refresh_ui_for_wallet(wallet_name)
+        with self.wallet_locks[wallet_name]:
+            if payment_data.id is None:
+                # Finish initialising the new payment and add it to the list.
+                payment_data.id = uuid.uuid4().hex
+                payment_data.date_created = int(self.clock.getTime())
+            else:
+                # Replace the old version with the new version.
+                entry = wallet_data.get_payment(payment_data.id)
+                if entry is None:
+                    # The payment was deleted while it was being edited.
+                    return
+                payment_data.date_created = entry.date_created
+                payment_data.date_last_paid = entry.date_last_paid
+                payment_data.txid_last_paid = entry.txid_last_paid
+                payment_data.dates_overdue = entry.dates_overdue
+                        
+            payment_data.date_updated = int(self.clock.getTime())
+            self.wallet_due_queues[wallet_name].setDueTime(payment_data.id, payment_data.date_next_paid)
+            self.update_next_due_time(wallet_name)
+            self.wallet_forecast_engines[wallet_name].invalidate([ payment_data.id ])
+            
+            wallet_data.set_payment(payment_data) # This is expected to trigger the wallet data to save.
+        self.refresh_ui_for_wallet(wallet_name, [ payment_data.id ])
         
     def delete_payments(self, wallet_name, payment_ids):
         wallet_data = self.wallet_data[wallet_name]
-        payment_entries = wallet_data.get(PAYMENT_DATA_KEY, [])
         
-        for entry in payment_entries[:]:
-            if entry[PAYMENT_ID] in payment_ids:
-                payment_entries.remove(entry)
+        due_queue = self.wallet_due_queues[wallet_name]
+        with self.wallet_locks[wallet_name]:
+            for entry in wallet_data.remove_payments(payment_ids): # This is expected to trigger the wallet data to save.
+                due_queue.remove(entry.id)
+            self.update_next_due_time(wallet_name)
+            self.wallet_forecast_engines[wallet_name].invalidate(payment_ids)
                 
-        wallet_data[PAYMENT_DATA_KEY] = payment_entries # This is expected to trigger the wallet data to save.
-        self.refresh_ui_for_wallet(wallet_name)
+        self.refresh_ui_for_wallet(wallet_name, payment_ids)
+
+
+def make_autopay_transaction(wallet, config, network, outputs):
+    """ Run on an autopay worker thread.  Returns the id of the broadcast transaction and None, or None and an error message. """
+    password = None
+    try:
+        with stats.timed("autopay_payments"):
+            tx = wallet.mktx(outputs, password, config)
+            status, data = network.broadcast(tx)
+    except Exception as e:
+        return None, str(e)
+    if status:
+        # data is txid.
+        return data, None
+    # data is error message
+    return None, data
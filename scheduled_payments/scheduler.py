@@ -1,7 +1,13 @@
-import time
+import calendar
 import datetime
+import heapq
+import itertools
+import time
 
-from PyQt5.QtCore import *
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # Work around stupid Python packaging import limitations for standalone testing.
 try:
@@ -52,58 +58,368 @@ class WhenEstimator:
         self.when = when
 
     def getNextOccurrences(self, maxMatches=1, maxTime=None):
-        startDateTime = QDateTime()
-        startDateTime.setSecsSinceEpoch(self.startSecsSinceEpoch)
-        
+        return list(itertools.islice(self.iterOccurrences(maxTime), maxMatches))
+
+    def iterOccurrences(self, maxTime=None):
+        """ The occurrences in order, generated as they are asked for, and without end unless a maximum time is given. """
         # When checking is the first date is correct, if it that day (weekday or monthday) then skip if time has passed.
         # When checking for subsequent dates, just need to search forward.
         # That's the difference between finding the first date, and finding the next date, as the time is only relevant on the first 
         
-        matches = []
-        whenTime = QTime(self.when.hour, self.when.minute)
-        fixedTime = startDateTime.time()
-        lastPythonTime = self.startSecsSinceEpoch
-        while maxMatches is None or maxMatches > len(matches):
-            workingDate = startDateTime.date()
+        if self.when.weekDay is None and self.when.monthDay is None:
+            return
+
+        startDateTime = datetime.datetime.fromtimestamp(self.startSecsSinceEpoch)
+        workingDate = startDateTime.date()
+        whenTime = datetime.time(self.when.hour, self.when.minute)
+        skipDay = startDateTime.hour > self.when.hour or startDateTime.hour == self.when.hour and startDateTime.minute >= self.when.minute
+        while True:
             if self.when.weekDay is not None:
-                currentDayOfWeek = workingDate.dayOfWeek()
-                if currentDayOfWeek == self.when.weekDay:
-                    # If the time on the start date has passed, then it will be a week later.
-                    if len(matches) or fixedTime.hour() > self.when.hour or fixedTime.hour() == self.when.hour and fixedTime.minute() >= self.when.minute:
-                        workingDate = workingDate.addDays(7)
-                # Lazily work out where the next matching day of the week falls.
-                while workingDate.dayOfWeek() != self.when.weekDay:
-                    workingDate = workingDate.addDays(1)
-            elif self.when.monthDay is not None:
-                if workingDate.day() == self.when.monthDay:
-                    # If the time on the start date has passed, then it will be a week later.
-                    if len(matches) or fixedTime.hour() > self.when.hour or fixedTime.hour() == self.when.hour and fixedTime.minute() >= self.when.minute:
-                        workingDate = workingDate.addMonths(1)
-                # Lazily work out where the next matching month day falls.  This will work correctly in skipping a month, if there are not enough days in that month.
-                while workingDate.day() != self.when.monthDay:
-                    workingDate = workingDate.addDays(1)
-        
-            newDateTime = QDateTime(startDateTime)
-            newDateTime.setDate(workingDate)
-            newDateTime.setTime(whenTime)
-            lastPythonTime = newDateTime.toSecsSinceEpoch()
+                workingDate = nextWeekDayDate(workingDate, self.when.weekDay, skipDay)
+            else:
+                workingDate = nextMonthDayDate(workingDate, self.when.monthDay, skipDay)
+            # Only the first date can fall on the start day, subsequent ones always move forward.
+            skipDay = True
+
+            lastPythonTime = localTimeSeconds(datetime.datetime.combine(workingDate, whenTime))
+            if lastPythonTime <= self.startSecsSinceEpoch:
+                # Starting at an occurrence that fell in a daylight savings gap, finds that same occurrence again.
+                continue
             if maxTime is not None and lastPythonTime > maxTime:
-                break            
-            matches.append(lastPythonTime)
-            startDateTime = newDateTime
-            
-        return matches
-        
-def roundTimeSeconds(secondsSinceEpoch):
-    startDateTime = QDateTime()
-    startDateTime.setSecsSinceEpoch(secondsSinceEpoch)
-    
-    startTime = startDateTime.time()
-    startTime.setHMS(startTime.hour(), startTime.minute(), 1, 0)
-    
-    startDateTime.setTime(startTime)
-    return startDateTime.toSecsSinceEpoch()
-    
+                return
+            yield lastPythonTime
+
+
+def getOccurrencesBatch(whens, startTimes, endTimes, maxMatches=None):
+    """
+    Estimate the occurrences of many whens in one pass.  For each when, this is the equivalent of
+    `WhenEstimator(startTime, when).getNextOccurrences(maxMatches, endTime)`.  The start and end times can either be shared
+    by all the whens, or be given per when.
+
+    Returns two flat arrays of the same length, the index of the when each occurrence belongs to, and the time of the
+    occurrence.  These are ordered by when index, and then by time.  NumPy arrays are returned where NumPy is available,
+    and lists otherwise.
+    """
+    whenCount = len(whens)
+    if numpy is None:
+        return _getOccurrencesBatchSlow(whens, startTimes, endTimes, maxMatches)
+
+    startTimes = numpy.broadcast_to(numpy.asarray(startTimes, dtype=numpy.float64), (whenCount,)).astype(numpy.int64)
+    endTimes = numpy.broadcast_to(numpy.asarray(endTimes, dtype=numpy.float64), (whenCount,))
+    weekDays = numpy.fromiter((0 if w.weekDay is None else w.weekDay for w in whens), dtype=numpy.int64, count=whenCount)
+    monthDays = numpy.fromiter((0 if w.monthDay is None or w.weekDay is not None else w.monthDay for w in whens), dtype=numpy.int64, count=whenCount)
+    whenSeconds = numpy.fromiter((w.hour * 3600 + w.minute * 60 for w in whens), dtype=numpy.int64, count=whenCount)
+    if whenCount == 0:
+        return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+
+    offsets = LocalTimeOffsets(startTimes.min(), endTimes.max())
+    localStartTimes = offsets.toLocal(startTimes)
+    startDays = localStartTimes // 86400
+    # Like the estimator, the time on the start date is only compared to the minute.
+    skipStartDay = (localStartTimes % 86400) // 60 * 60 >= whenSeconds
+    # The end day is padded, as a daylight savings change may still bring an occurrence on the following day under the end time.
+    endDays = offsets.toLocal(numpy.floor(endTimes).astype(numpy.int64)) // 86400 + 1
+
+    # Weekly: The first matching day, and then one every seven days.
+    isWeekly = weekDays > 0
+    dayDeltas = (weekDays - ((startDays + 3) % 7 + 1)) % 7
+    dayDeltas[(dayDeltas == 0) & skipStartDay] = 7
+    firstDays = startDays + dayDeltas
+    weeklyCounts = numpy.where(isWeekly, numpy.maximum(0, (endDays - firstDays) // 7 + 1), 0)
+
+    # Monthly: Every month from the first candidate month, filtered down to the months that have the given day.
+    isMonthly = monthDays > 0
+    startMonths = startDays.astype("datetime64[D]").astype("datetime64[M]").astype(numpy.int64)
+    startMonthDays = startDays - _monthStartDays(startMonths) + 1
+    firstMonths = startMonths + ((startMonthDays > monthDays) | (startMonthDays == monthDays) & skipStartDay)
+    endMonths = endDays.astype("datetime64[D]").astype("datetime64[M]").astype(numpy.int64)
+    monthlyCounts = numpy.where(isMonthly, numpy.maximum(0, endMonths - firstMonths + 1), 0)
+
+    weeklyIndexes, weeklySteps = _expandCounts(weeklyCounts)
+    weeklyDays = firstDays[weeklyIndexes] + weeklySteps * 7
+
+    monthlyIndexes, monthlySteps = _expandCounts(monthlyCounts)
+    months = firstMonths[monthlyIndexes] + monthlySteps
+    monthStartDays = _monthStartDays(months)
+    monthLengths = _monthStartDays(months + 1) - monthStartDays
+    hasMonthDay = monthLengths >= monthDays[monthlyIndexes]
+    monthlyIndexes = monthlyIndexes[hasMonthDay]
+    monthlyDays = monthStartDays[hasMonthDay] + monthDays[monthlyIndexes] - 1
+
+    indexes = numpy.concatenate((weeklyIndexes, monthlyIndexes))
+    days = numpy.concatenate((weeklyDays, monthlyDays))
+    times = offsets.fromLocal(days * 86400 + whenSeconds[indexes])
+    inRange = (times <= endTimes[indexes]) & (times > startTimes[indexes])
+    indexes, times = indexes[inRange], times[inRange]
+
+    order = numpy.lexsort((times, indexes))
+    indexes, times = indexes[order], times[order]
+    if maxMatches is not None:
+        ranks = numpy.arange(len(indexes)) - numpy.searchsorted(indexes, indexes, side="left")
+        withinLimit = ranks < maxMatches
+        indexes, times = indexes[withinLimit], times[withinLimit]
+    return indexes, times
+
+def groupOccurrencesBatch(whenCount, indexes, times):
+    """ Split the flat result of `getOccurrencesBatch` into a list of occurrence times for each when. """
+    if numpy is not None:
+        indexes, times = numpy.asarray(indexes).tolist(), numpy.asarray(times).tolist()
+    groups = [ [] for i in range(whenCount) ]
+    for index, occurrenceTime in zip(indexes, times):
+        groups[index].append(occurrenceTime)
+    return groups
+
+def iterOccurrences(when, startTime, endTime=None):
+    """
+    The occurrences after the start time, up to and including the end time if given, generated one at a time so that the
+    caller can stop whenever it likes.  `countOccurrences` and `getNthOccurrence` answer how many there are, and which one
+    is at a given position, without generating any of them.
+    """
+    return WhenEstimator(startTime, when).iterOccurrences(endTime)
+
+def countOccurrences(when, startTime, endTime):
+    """ The number of occurrences after the start time, up to and including the end time, worked out without generating them. """
+    firstDate = getFirstOccurrenceDate(when, startTime)
+    if firstDate is None:
+        return 0
+    endDate = datetime.datetime.fromtimestamp(int(endTime)).date()
+    if when.weekDay is not None:
+        count = max(0, (endDate - firstDate).days // 7 + 1)
+    else:
+        count = countMonthDayDates(firstDate, when.monthDay, endDate)
+    # The last candidate may fall on the end date, but after the end time.
+    if count > 0 and getNthOccurrenceFromDate(when, firstDate, count - 1) > endTime:
+        count -= 1
+    return count
+
+def getNthOccurrence(when, startTime, n):
+    """ The time of the zero-based nth occurrence after the start time, worked out without generating the ones before it. """
+    firstDate = getFirstOccurrenceDate(when, startTime)
+    if firstDate is None:
+        return None
+    return getNthOccurrenceFromDate(when, firstDate, n)
+
+def getNthOccurrenceFromDate(when, firstDate, n):
+    nthDate = getNthOccurrenceDate(when, firstDate, n)
+    return localTimeSeconds(datetime.datetime.combine(nthDate, datetime.time(when.hour, when.minute)))
+
+def getNthOccurrenceDate(when, firstDate, n):
+    if when.weekDay is not None:
+        return firstDate + datetime.timedelta(days=7 * n)
+    return nthMonthDayDate(firstDate, when.monthDay, n)
+
+def getFirstOccurrenceDate(when, startTime):
+    """ The date of the first occurrence after the start time, with the same rules as `WhenEstimator`. """
+    startDateTime = datetime.datetime.fromtimestamp(int(startTime))
+    skipDay = startDateTime.hour > when.hour or startDateTime.hour == when.hour and startDateTime.minute >= when.minute
+    if when.weekDay is not None:
+        firstDate = nextWeekDayDate(startDateTime.date(), when.weekDay, skipDay)
+    elif when.monthDay is not None:
+        firstDate = nextMonthDayDate(startDateTime.date(), when.monthDay, skipDay)
+    else:
+        return None
+    if getNthOccurrenceFromDate(when, firstDate, 0) <= int(startTime):
+        # Starting at an occurrence that fell in a daylight savings gap, finds that same occurrence again.
+        firstDate = getNthOccurrenceDate(when, firstDate, 1)
+    return firstDate
+
+def _getOccurrencesBatchSlow(whens, startTimes, endTimes, maxMatches):
+    whenCount = len(whens)
+    if not isinstance(startTimes, (list, tuple)):
+        startTimes = [ startTimes ] * whenCount
+    if not isinstance(endTimes, (list, tuple)):
+        endTimes = [ endTimes ] * whenCount
+    indexes, times = [], []
+    for i, when in enumerate(whens):
+        matches = WhenEstimator(startTimes[i], when).getNextOccurrences(maxMatches, endTimes[i])
+        indexes.extend([ i ] * len(matches))
+        times.extend(matches)
+    return indexes, times
+
+def _expandCounts(counts):
+    """ For the given per-when counts, the when index and the zero-based step within that when, of each expanded entry. """
+    indexes = numpy.repeat(numpy.arange(len(counts)), counts)
+    steps = numpy.arange(len(indexes)) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    return indexes, steps
+
+def _monthStartDays(months):
+    """ The days since the epoch, of the first day of each of the months since the epoch. """
+    return months.astype("datetime64[M]").astype("datetime64[D]").astype(numpy.int64)
+
+
+class LocalTimeOffsets:
+    """
+    The local time zone UTC offsets in effect over a span of time, so that arrays of times can be converted to and from
+    local time in one go.  Offsets are sampled daily, and the exact second of any change located within the day.
+    """
+
+    def __init__(self, startTime, endTime):
+        startTime = int(startTime) - 2 * 86400
+        endTime = int(endTime) + 2 * 86400
+        changeTimes = [ startTime ]
+        offsets = [ _utcOffset(startTime) ]
+        for sampleTime in range(startTime + 86400, endTime + 86400, 86400):
+            sampleOffset = _utcOffset(sampleTime)
+            if sampleOffset != offsets[-1]:
+                # Binary search for the first second the new offset applies at.
+                lowTime, highTime = sampleTime - 86400, sampleTime
+                while highTime - lowTime > 1:
+                    middleTime = (lowTime + highTime) // 2
+                    if _utcOffset(middleTime) == offsets[-1]:
+                        lowTime = middleTime
+                    else:
+                        highTime = middleTime
+                changeTimes.append(highTime)
+                offsets.append(sampleOffset)
+        self.changeTimes = numpy.array(changeTimes, dtype=numpy.int64)
+        self.offsets = numpy.array(offsets, dtype=numpy.int64)
+
+    def _indexes(self, times):
+        return numpy.maximum(0, numpy.searchsorted(self.changeTimes, times, side="right") - 1)
+
+    def toLocal(self, times):
+        return times + self.offsets[self._indexes(times)]
+
+    def fromLocal(self, localTimes):
+        """ Local times that are skipped or repeated by daylight savings changes resolve to the earlier candidate, like `localTimeSeconds`. """
+        lastIndex = len(self.offsets) - 1
+        guessIndexes = self._indexes(localTimes - self.offsets[self._indexes(localTimes)])
+        times = numpy.full(len(localTimes), numpy.iinfo(numpy.int64).max, dtype=numpy.int64)
+        fallbackTimes = times.copy()
+        for indexDelta in (-1, 0, 1):
+            candidateIndexes = numpy.clip(guessIndexes + indexDelta, 0, lastIndex)
+            candidateTimes = localTimes - self.offsets[candidateIndexes]
+            isValid = self._indexes(candidateTimes) == candidateIndexes
+            times = numpy.where(isValid, numpy.minimum(times, candidateTimes), times)
+            fallbackTimes = numpy.minimum(fallbackTimes, candidateTimes)
+        # Skipped local times have no valid candidate, and resolve using the offset from after the change.
+        return numpy.where(times == numpy.iinfo(numpy.int64).max, fallbackTimes, times)
+
+def _utcOffset(secondsSinceEpoch):
+    return time.localtime(secondsSinceEpoch).tm_gmtoff
+
+
+def localTimeSeconds(localDateTime):
+    """
+    Local times that are skipped or repeated by daylight savings changes resolve to the earlier candidate.  For skipped
+    times this is what Qt did.  For repeated times Qt did not consistently pick either, as it reused the offset of the
+    start time, and it would often pick the later one.  The earlier one is always picked here.
+    """
+    return int(min(localDateTime.timestamp(), localDateTime.replace(fold=1).timestamp()))
+
+def nextWeekDayDate(fromDate, weekDay, skipDay=False):
+    """ The first date on or after the given date (or strictly after it if skipping it) that falls on the 1-based ISO week day. """
+    dayDelta = (weekDay - fromDate.isoweekday()) % 7
+    if dayDelta == 0 and skipDay:
+        dayDelta = 7
+    return fromDate + datetime.timedelta(days=dayDelta)
+
+def nextMonthDayDate(fromDate, monthDay, skipDay=False):
+    """ The first date on or after the given date (or strictly after it if skipping it) that falls on the month day.  Months without that day are skipped. """
+    year, month = fromDate.year, fromDate.month
+    if fromDate.day > monthDay or fromDate.day == monthDay and skipDay:
+        year, month = nextMonth(year, month)
+    while calendar.monthrange(year, month)[1] < monthDay:
+        year, month = nextMonth(year, month)
+    return datetime.date(year, month, monthDay)
+
+def nthMonthDayDate(firstDate, monthDay, n):
+    """ Given a first date that falls on the month day, the date of the zero-based nth month day from it.  Months without that day are skipped. """
+    year, month = firstDate.year, firstDate.month
+    if monthDay <= 28:
+        monthIndex = year * 12 + month - 1 + n
+        return datetime.date(monthIndex // 12, monthIndex % 12 + 1, monthDay)
+    while n > 0:
+        year, month = nextMonth(year, month)
+        if calendar.monthrange(year, month)[1] >= monthDay:
+            n -= 1
+    return datetime.date(year, month, monthDay)
+
+def countMonthDayDates(firstDate, monthDay, lastDate):
+    """ Given a first date that falls on the month day, the number of month days from it up to and including the last date. """
+    if lastDate < firstDate:
+        return 0
+    lastDayCount = 1 if lastDate.day >= monthDay else 0
+    if monthDay <= 28:
+        return (lastDate.year - firstDate.year) * 12 + lastDate.month - firstDate.month + lastDayCount
+    count = 0
+    year, month = firstDate.year, firstDate.month
+    while (year, month) < (lastDate.year, lastDate.month):
+        if calendar.monthrange(year, month)[1] >= monthDay:
+            count += 1
+        year, month = nextMonth(year, month)
+    return count + lastDayCount
+
+def nextMonth(year, month):
+    if month == 12:
+        return year + 1, 1
+    return year, month + 1
+
+
+class DueQueue:
+    """
+    Keys ordered by the time they next become due, so that the due ones can be found without looking at the rest.  When the
+    due time of a key is changed or the key is removed, the old heap entry is left in place and discarded when it surfaces.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.dueTimes = {}
+
+    def __len__(self):
+        return len(self.dueTimes)
+
+    def setDueTime(self, key, dueTime):
+        if dueTime is None:
+            self.remove(key)
+            return
+        if self.dueTimes.get(key, None) == dueTime:
+            return
+        self.dueTimes[key] = dueTime
+        heapq.heappush(self.heap, (dueTime, key))
+        # Stop discarded entries from accumulating without bound.
+        if len(self.heap) > 2 * len(self.dueTimes) + 16:
+            self.heap = [ (entryTime, entryKey) for entryKey, entryTime in self.dueTimes.items() ]
+            heapq.heapify(self.heap)
+
+    def remove(self, key):
+        self.dueTimes.pop(key, None)
+
+    def _discardStaleEntries(self):
+        while len(self.heap) and self.dueTimes.get(self.heap[0][1], None) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+
+    def peekTime(self):
+        """ The earliest due time, or None if there are no keys. """
+        self._discardStaleEntries()
+        if len(self.heap):
+            return self.heap[0][0]
+
+    def popDue(self, currentTime):
+        """ Remove and return the keys that are due at the given time, earliest first. """
+        keys = []
+        self._discardStaleEntries()
+        while len(self.heap) and self.heap[0][0] <= currentTime:
+            dueTime, key = heapq.heappop(self.heap)
+            del self.dueTimes[key]
+            keys.append(key)
+            self._discardStaleEntries()
+        return keys
+
+    def getDue(self, currentTime):
+        """ Return the keys that are due at the given time, without removing them. """
+        keys = set()
+        pendingIndexes = [ 0 ]
+        while len(pendingIndexes):
+            i = pendingIndexes.pop()
+            if i >= len(self.heap) or self.heap[i][0] > currentTime:
+                continue
+            dueTime, key = self.heap[i]
+            if self.dueTimes.get(key, None) == dueTime:
+                keys.add(key)
+            pendingIndexes.extend((2 * i + 1, 2 * i + 2))
+        return list(keys)
+
     
         
 if __name__ == "__main__":
@@ -137,7 +453,4 @@ if __name__ == "__main__":
 
     for v in l:
         print(datetime.datetime.fromtimestamp(v).strftime("%c"))
-
-    roundStartTime = roundTimeSeconds(startTime)
-    print(roundStartTime, datetime.datetime.fromtimestamp(roundStartTime).strftime("%c"))
     
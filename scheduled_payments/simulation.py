@@ -0,0 +1,200 @@
+"""
+A headless simulation of the plugin processing the due payments of synthetic wallets over a period of time.  Rather than
+waiting on the scheduler thread, the fake clock is moved straight to the next time any payment is due, and the due
+payments are processed there, so that a year of schedules can be replayed in seconds.  The wallets have a stub network
+that accepts or rejects automatic payments at random, and the outcome is written as JSON.
+
+Like the plugin benchmarks, this needs Electron Cash to be importable:
+
+    python -m scheduled_payments.simulation --payments 1000 --days 365
+"""
+
+import argparse
+import concurrent.futures
+import contextlib
+import json
+import random
+import time
+
+# Work around stupid Python packaging import limitations for standalone testing.
+try:
+    from . import scheduler
+    from .benchmark import BenchmarkWallet, BenchmarkWindow, Plugin, PLUGIN_IMPORT_ERROR, create_payments, create_wallet_storage, BENCHMARK_START_TIME
+    from .constants import *
+    from .instrumentation import stats
+except:
+    import scheduler
+    from benchmark import BenchmarkWallet, BenchmarkWindow, Plugin, PLUGIN_IMPORT_ERROR, create_payments, create_wallet_storage, BENCHMARK_START_TIME
+    from constants import *
+    from instrumentation import stats
+
+
+class SimulationExecutor:
+    """ Runs submitted work immediately on the calling thread, so that the outcome of each step is deterministic. """
+
+    def submit(self, function, *args):
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(function(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+class SimulationNetwork:
+    """ Accepts broadcast transactions, except for the given fraction of them which are rejected. """
+
+    def __init__(self, rng, failure_rate):
+        self.rng = rng
+        self.failure_rate = failure_rate
+        self.broadcast_count = 0
+        self.failure_count = 0
+
+    def broadcast(self, tx):
+        self.broadcast_count += 1
+        if self.rng.random() < self.failure_rate:
+            self.failure_count += 1
+            return False, "simulated broadcast failure"
+        return True, "%064x" % self.rng.getrandbits(256)
+
+
+class SimulationWallet(BenchmarkWallet):
+    def __init__(self, storage, wallet_name):
+        BenchmarkWallet.__init__(self, storage)
+        self.wallet_name = wallet_name
+
+    def basename(self):
+        return self.wallet_name
+
+    def has_password(self):
+        # Payments that are flagged for it, are paid automatically.
+        return False
+
+    def mktx(self, outputs, password, config):
+        return outputs
+
+
+class SimulationWindow(BenchmarkWindow):
+    def __init__(self, wallet, network):
+        BenchmarkWindow.__init__(self, wallet)
+        self.network = network
+        self.notification_count = 0
+
+    def notify(self, message):
+        self.notification_count += 1
+
+
+class SimulationPaymentsList:
+    """ Stands in for the payments list of a wallet, which has nothing to show in a simulation. """
+
+    def update_payments(self, payment_ids=None):
+        pass
+
+    def update_addresses(self, addresses):
+        pass
+
+
+def create_simulation_plugin(wallet_count, payment_count, autopay_fraction, failure_rate, seed):
+    from electroncash.address import Address
+
+    plugin = Plugin(None, None, "scheduled_payments")
+    plugin.clock = scheduler.FakeClock(BENCHMARK_START_TIME)
+    plugin.autopay_executor = SimulationExecutor()
+    plugin.due_payments_executor = SimulationExecutor()
+
+    rng = random.Random(seed)
+    for i in range(wallet_count):
+        wallet_name = "simulation-%d" % i
+        payments = create_payments(payment_count, rng, BENCHMARK_START_TIME)
+        for payment_data in payments:
+            # Automatic payments need addresses that can actually be paid to.
+            payment_data.address = Address.from_P2PKH_hash(bytes(rng.getrandbits(8) for j in range(20))).to_ui_string()
+            if rng.random() < autopay_fraction:
+                payment_data.flags |= PAYMENT_FLAG_AUTOPAY
+        network = SimulationNetwork(rng, failure_rate)
+        window = SimulationWindow(SimulationWallet(create_wallet_storage(payments), wallet_name), network)
+        plugin.wallet_windows[wallet_name] = window
+        plugin.wallet_payment_lists[wallet_name] = SimulationPaymentsList()
+        plugin.load_data_for_wallet(wallet_name, window)
+    return plugin
+
+def run_simulation(plugin, end_time):
+    """
+    Step the fake clock from one due time to the next up to the end time, processing the due payments at each.  The whole
+    run is one transaction for each wallet, as otherwise every step writes all of the wallet's payments to its storage,
+    which would take up most of the time of a long run.
+    """
+    step_count = 0
+    due_count = 0
+    with contextlib.ExitStack() as stack:
+        for wallet_name in plugin.get_open_wallet_names():
+            stack.enter_context(plugin.wallet_data[wallet_name].transaction())
+        while plugin.next_due_time is not None and plugin.next_due_time <= end_time:
+            current_time = plugin.next_due_time
+            plugin.clock.setTime(current_time)
+            for wallet_name in plugin.get_open_wallet_names():
+                due_count += len(plugin.get_due_payments_for_wallet(wallet_name, current_time))
+                plugin.process_due_payments(wallet_name, current_time=current_time)
+            step_count += 1
+    plugin.clock.setTime(end_time)
+    return step_count, due_count
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Replay the scheduled payments of synthetic wallets over a period of time.")
+    parser.add_argument("--wallets", type=int, default=1, help="number of open wallets")
+    parser.add_argument("--payments", type=int, default=1000, help="number of scheduled payments per wallet")
+    parser.add_argument("--days", type=float, default=365, help="how long a period to simulate")
+    parser.add_argument("--autopay-fraction", type=float, default=0.5, help="fraction of payments that are paid automatically")
+    parser.add_argument("--failure-rate", type=float, default=0.1, help="fraction of automatic payments that fail to broadcast")
+    parser.add_argument("--seed", type=int, default=1, help="seed for the synthetic wallets and network")
+    parser.add_argument("--output", default=None, help="file to write the JSON results to, rather than standard output")
+    args = parser.parse_args(args)
+
+    if Plugin is None:
+        parser.exit(1, "The plugin could not be imported: %s\n" % PLUGIN_IMPORT_ERROR)
+
+    plugin = create_simulation_plugin(args.wallets, args.payments, args.autopay_fraction, args.failure_rate, args.seed)
+    end_time = BENCHMARK_START_TIME + args.days * 24 * 60 * 60
+    start_time = time.perf_counter()
+    step_count, due_count = run_simulation(plugin, end_time)
+    elapsed_time = time.perf_counter() - start_time
+
+    wallets = []
+    for wallet_name, window in plugin.wallet_windows.items():
+        payments = plugin.get_wallet_payments(wallet_name)
+        wallets.append({
+            "name": wallet_name,
+            "payments": len(payments),
+            "overdue_occurrences": sum(len(payment_data.dates_overdue) for payment_data in payments),
+            "autopaid_payments": sum(1 for payment_data in payments if payment_data.txid_last_paid is not None),
+            "broadcasts": window.network.broadcast_count,
+            "broadcast_failures": window.network.failure_count,
+            "notifications": window.notification_count,
+        })
+
+    report = {
+        "start_time": BENCHMARK_START_TIME,
+        "end_time": end_time,
+        "seed": args.seed,
+        "steps": step_count,
+        "due_payments": due_count,
+        "elapsed_seconds": elapsed_time,
+        "simulated_days_per_second": args.days / elapsed_time if elapsed_time else None,
+        "wallets": wallets,
+        "stats": stats.get_snapshot(),
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, "w") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,30 +1,102 @@
+import collections
 import datetime
 
 DISPLAY_AS_AMOUNT = 1
 DISPLAY_AS_ADDRESS = 2
 DISPLAY_AS_DATETIME = 3
 
+
+def get_row_ranges(rows):
+    """ The sorted rows grouped into ranges of consecutive rows, as (first row, last row) pairs. """
+    ranges = []
+    for row in sorted(rows):
+        if len(ranges) and ranges[-1][1] == row - 1:
+            ranges[-1][1] = row
+        else:
+            ranges.append([ row, row ])
+    return ranges
+
+
+class LRUCache:
+    """ A mapping that holds at most the given number of entries, evicting the least recently used when it is full. """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        try:
+            self.entries.move_to_end(key)
+        except KeyError:
+            return default
+        return self.entries[key]
+
+    def set(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def discard(self, key):
+        self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
+
+
 class ValueFormatter:
-    def __init__(self, window):
+    """
+    Formats values for display for a wallet window.  There is one of these per wallet, so that the formatted values can be
+    cached across all the lists and dialogs for that wallet.  The cached contact labels are invalidated by address when
+    contacts change, and the cached amounts are discarded when the base unit changes.
+    """
+
+    def __init__(self, window, max_cache_size=4096):
         self.window = window
         self.wallet = window.wallet
-        
+
+        self.amount_cache = LRUCache(max_size=max_cache_size)
+        self.amount_base_unit = None
+        self.address_cache = LRUCache(max_size=max_cache_size)
+        self.datetime_cache = LRUCache(max_size=max_cache_size)
+
     def format_contact(self, address):
         if address in self.wallet.contacts.keys():
             contact_type, contact_name = self.wallet.contacts[address]
-            return contact_name +" <"+ address +">"        
+            return contact_name +" <"+ address +">"
+
+    def invalidate_addresses(self, addresses):
+        for address in addresses:
+            self.address_cache.discard(address)
 
     def format_value(self, value, display_type=0):
         if display_type == DISPLAY_AS_AMOUNT:
-            return self.window.format_amount(value, whitespaces = False) +' '+ self.window.base_unit()
+            base_unit = self.window.base_unit()
+            if base_unit != self.amount_base_unit:
+                self.amount_cache.clear()
+                self.amount_base_unit = base_unit
+            text = self.amount_cache.get(value)
+            if text is None:
+                text = self.window.format_amount(value, whitespaces = False) +' '+ base_unit
+                self.amount_cache.set(value, text)
+            return text
         elif display_type == DISPLAY_AS_ADDRESS:
-            contact_name = self.format_contact(value)
-            if contact_name is None:
-                contact_name = value
-            return contact_name
+            text = self.address_cache.get(value)
+            if text is None:
+                text = self.format_contact(value)
+                if text is None:
+                    text = value
+                self.address_cache.set(value, text)
+            return text
         elif display_type == DISPLAY_AS_DATETIME:
             if value is None:
                 return "-"
-            return datetime.datetime.fromtimestamp(value).strftime("%Y-%m-%d %H:%M")
+            text = self.datetime_cache.get(value)
+            if text is None:
+                text = datetime.datetime.fromtimestamp(value).strftime("%Y-%m-%d %H:%M")
+                self.datetime_cache.set(value, text)
+            return text
         return str(value)
-
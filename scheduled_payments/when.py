@@ -1,13 +1,37 @@
 
 
 
+# Work around stupid Python packaging import limitations for standalone testing.
+try:
+    from .util import LRUCache
+except:
+    from util import LRUCache
+
+# The compiled When objects, keyed by their canonical text.  Texts that are not canonical are parsed each time they are
+# seen, but that is not what the wallet storage holds.  The number of distinct schedules is bounded by the cache rather
+# than trusted to be small, and a schedule that is evicted is compiled to a new object if it is seen again.
+compiledWhens = LRUCache(max_size=1024)
+
+
 class When:
+    """
+    How a payment is scheduled.  Those that are built up with the setters are mutable, but those that are parsed from text
+    or compiled are interned and immutable, so that all the payments with the same schedule share the one object.
+    """
+
     def __init__(self):
         self.monthDay = None
         self.weekDay = None
         self.hour = 0
         self.minute = 0
+        # The canonical text, which is only set once compiled.
+        self.text = None
         
+    def __setattr__(self, name, value):
+        if self.__dict__.get("text", None) is not None:
+            raise AttributeError("compiled When objects are immutable")
+        object.__setattr__(self, name, value)
+
     def __repr__(self):
         if self.monthDay is None and self.weekDay is None:
             import traceback
@@ -24,9 +48,14 @@ class When:
         self.hour, self.minute = hour, minute
         
     def isSame(self, otherWhen):
+        if otherWhen is self:
+            return True
         return otherWhen is not None and self.monthDay == otherWhen.monthDay and self.weekDay == otherWhen.weekDay and self.hour == otherWhen.hour and self.minute == otherWhen.minute
  
     def toText(self):
+        if self.text is not None:
+            return self.text
+
         whenText = ""
         if self.weekDay is not None:
             whenText = "WEEKDAY-"+ str(self.weekDay)
@@ -37,8 +66,28 @@ class When:
             whenText += " TIME-%02d:%02d" % (self.hour, self.minute)        
         return whenText
 
+    def compile(self):
+        """ The compiled When with the same schedule as this one. """
+        return self.fromText(self.toText())
+
     @classmethod
     def fromText(class_, whenText):
+        """ The compiled When for the given text, which is only parsed the first time it is seen. """
+        when = compiledWhens.get(whenText)
+        if when is None:
+            when = class_.parseText(whenText)
+            canonicalText = when.toText()
+            compiledWhen = compiledWhens.get(canonicalText)
+            if compiledWhen is None:
+                when.text = canonicalText
+                compiledWhens.set(canonicalText, when)
+            else:
+                when = compiledWhen
+        return when
+
+    @classmethod
+    def parseText(class_, whenText):
+        """ A new mutable When parsed from the given text. """
         when = class_()
 
         if whenText:
@@ -57,3 +106,46 @@ class When:
                         when.setTime(*time_values)
     
         return when
+
+
+if __name__ == "__main__":
+    # Benchmark of the cost the compiled When cache removes from loading a wallet's payments and working out which of them
+    # are due, which is decoding each payment's schedule and counting the occurrences it has missed.
+    import random
+    import timeit
+    import tracemalloc
+
+    import scheduler
+
+    random.seed(1)
+    whenTexts = []
+    for i in range(10000):
+        when = When()
+        if random.random() < 0.5:
+            when.setWeekDay(random.randint(1, 7))
+        else:
+            when.setMonthDay(random.choice([ 1, 15, 28, 31 ]))
+        when.setTime(random.choice([ 0, 9, 12 ]), 0)
+        whenTexts.append(when.toText())
+    print("%d payments, %d distinct schedules" % (len(whenTexts), len(set(whenTexts))))
+
+    startTime = 1525335600
+    currentTime = startTime + 30 * 24 * 60 * 60
+    def evaluate(whens):
+        for when in whens:
+            if scheduler.countOccurrences(when, startTime, currentTime):
+                scheduler.getNthOccurrence(when, startTime, 0)
+
+    def parseWhens(parse):
+        compiledWhens.clear()
+        return [ parse(text) for text in whenTexts ]
+
+    for label, parse in (("parsed", When.parseText), ("compiled", When.fromText)):
+        decodeSeconds = min(timeit.repeat(lambda: parseWhens(parse), number=1, repeat=5))
+        totalSeconds = min(timeit.repeat(lambda: evaluate(parseWhens(parse)), number=1, repeat=5))
+        tracemalloc.start()
+        whens = parseWhens(parse)
+        size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print("%-9s decode %8.2f ms  decode and evaluate %8.2f ms  %8d bytes  %5d objects" % (label, decodeSeconds * 1000,
+            totalSeconds * 1000, size, len(set(map(id, whens)))))
@@ -1,5 +1,7 @@
-import time
+import collections
 import datetime
+import itertools
+import time
 
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
@@ -12,12 +14,20 @@ from . import scheduler
 
 # This is aligned with QDate days of the week, but note that it's 1-based.
 DAY_NAMES = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+# How many of the upcoming matching dates are shown, including the next one.
+PREVIEW_OCCURRENCE_COUNT = 5
 
 class WhenWidget(QGroupBox):
     def __init__(self, text):
         QGroupBox.__init__(self, text)
         
+        # The estimate is kept until the current time reaches it or the when is changed.  The upcoming matching dates are
+        # drawn from a generator as the preview rolls forward, rather than being worked out again.
         self.estimatedTime = None
+        self.estimatedFromTime = None
+        self.estimatedWhen = None
+        self.occurrences = None
+        self.previewTimes = collections.deque()
         
         topRadioLayout = QVBoxLayout()
 
@@ -108,6 +118,18 @@ class WhenWidget(QGroupBox):
         projectionGroupLayout.addWidget(self.projectionEstimateLabel)
         projectionGroupBox.setLayout(projectionGroupLayout)
         topRadioLayout.addWidget(projectionGroupBox)
+
+        previewGroupBox = QGroupBox()
+        previewGroupLayout = QHBoxLayout()
+        self.previewLabel = QLabel(_('Following dates'))
+        self.previewLabel.setAlignment(Qt.AlignTop)
+        previewGroupLayout.addWidget(self.previewLabel)
+        previewGroupLayout.addStretch(1)
+        self.previewTimesLabel = QLabel("...")
+        self.previewTimesLabel.setAlignment(Qt.AlignRight)
+        previewGroupLayout.addWidget(self.previewTimesLabel)
+        previewGroupBox.setLayout(previewGroupLayout)
+        topRadioLayout.addWidget(previewGroupBox)
                 
         self.setLayout(topRadioLayout)
         
@@ -156,7 +178,7 @@ class WhenWidget(QGroupBox):
         minute = self.timeMinuteCombo.value()
         when.setTime(hour, minute)
         
-        return when
+        return when.compile()
         
     def setWhen(self, when):
         if type(when) is str:
@@ -181,19 +203,43 @@ class WhenWidget(QGroupBox):
         self.updateEstimatedTime(when)
     
     def updateEstimatedTime(self, when=None, currentTime=None):
+        """ Returns whether the estimated next matching date changed.  Nothing is worked out while the estimate still holds. """
         if when is None:
             when = self.getWhen()
         if currentTime is None:
             currentTime = time.time()
-        p = scheduler.WhenEstimator(currentTime, when)
-        matches = p.getNextOccurrences(1)
-        newEstimatedTime = matches[0]
+        if not when.isSame(self.estimatedWhen) or currentTime < self.estimatedFromTime:
+            self.estimatedWhen = when
+            self.occurrences = None
+        elif not self.isEstimateExpired(currentTime):
+            return False
+        self.estimatedFromTime = currentTime
+
+        while len(self.previewTimes) and self.previewTimes[0] <= currentTime:
+            self.previewTimes.popleft()
+        if self.occurrences is None or not len(self.previewTimes):
+            # Only the occurrences after the current time are of interest, however far it has moved on.
+            self.occurrences = scheduler.WhenEstimator(currentTime, when).iterOccurrences()
+            self.previewTimes.clear()
+        self.previewTimes.extend(itertools.islice(self.occurrences, PREVIEW_OCCURRENCE_COUNT - len(self.previewTimes)))
+        self.previewTimesLabel.setText("\n".join(self.formatTime(value) for value in itertools.islice(self.previewTimes, 1, None)))
+
+        newEstimatedTime = self.previewTimes[0] if len(self.previewTimes) else None
         if newEstimatedTime != self.estimatedTime:
             self.estimatedTime = newEstimatedTime
-            self.projectionEstimateLabel.setText(datetime.datetime.fromtimestamp(self.estimatedTime).strftime("%c"))
+            self.projectionEstimateLabel.setText("..." if newEstimatedTime is None else self.formatTime(newEstimatedTime))
             return True
         return False
 
+    def formatTime(self, value):
+        return datetime.datetime.fromtimestamp(value).strftime("%c")
+
+    def isEstimateExpired(self, currentTime):
+        """ The estimate holds from the time it was made from, until the estimated time is reached. """
+        if self.estimatedTime is None:
+            return True
+        return currentTime < self.estimatedFromTime or currentTime >= self.estimatedTime
+
     def getEstimatedTime(self):
         return self.estimatedTime
 